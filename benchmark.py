@@ -0,0 +1,236 @@
+# /usr/bin/env
+
+from satp_serial import MiotySerialSATP as SSATP
+from satp_serial import SATPDecoder, SATPEncoder, calc_crc, pack_frame
+from miotysensor import MiotySensor, BAUDRATE
+from fake_modem import FakeModem
+import mqtt_codec
+import argparse
+import json
+import platform
+import time
+
+
+def _rate(count, elapsed):
+    return count / elapsed if elapsed > 0 else 0
+
+
+def _latency_stats(latencies):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    return {
+        "count": count,
+        "min": latencies[0],
+        "mean": sum(latencies) / count,
+        "p50": latencies[count // 2],
+        "p99": latencies[min(int(count * 0.99), count - 1)],
+        "max": latencies[-1],
+    }
+
+
+def bench_crc(iterations, size=64):
+    data = bytes(range(256)) * (size // 256 + 1)
+    data = data[:size]
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        calc_crc(data)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "payload_bytes": size,
+        "crc_per_s": _rate(iterations, elapsed),
+        "mbyte_per_s": _rate(iterations * size, elapsed) / 1e6,
+    }
+
+
+def bench_encode(iterations, size=16):
+    encoder = SATPEncoder()
+    parameter = bytes(range(size))
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encoder.pack(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_NB_SEND, parameter)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "payload_bytes": size,
+        "frames_per_s": _rate(iterations, elapsed),
+    }
+
+
+def bench_decode(iterations, size=16, chunk=64, corrupt_every=0):
+    frame = pack_frame(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_NB_SEND, bytes(range(size)))
+    broken = frame[:-1] + bytes((frame[-1] ^ 0xFF,)) + b"\x00\xa5\x13"
+
+    stream = b"".join(
+        broken if corrupt_every and (i + 1) % corrupt_every == 0 else frame
+        for i in range(iterations)
+    )
+
+    decoder = SATPDecoder()
+    decoded = 0
+
+    start = time.perf_counter()
+    for pos in range(0, len(stream), chunk):
+        decoded += len(decoder.feed(stream[pos : pos + chunk]))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "payload_bytes": size,
+        "chunk_bytes": chunk,
+        "corrupt_every": corrupt_every,
+        "frames_decoded": decoded,
+        "errors": decoder.errors,
+        "frames_per_s": _rate(decoded, elapsed),
+        "mbyte_per_s": _rate(len(stream), elapsed) / 1e6,
+    }
+
+
+def bench_round_trip(iterations):
+    with FakeModem() as modem:
+        satp = SSATP(BAUDRATE, modem.port)
+        parameter = bytes((SSATP.E_STACK_PARAM_ID_MIOTY_EUI64,))
+
+        latencies = []
+        timeouts = 0
+        for _ in range(iterations):
+            start = time.perf_counter()
+            confirmation = satp.send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, parameter)
+            if confirmation is None:
+                timeouts += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        satp.close()
+
+    result = _latency_stats(latencies)
+    result["timeouts"] = timeouts
+
+    return result
+
+
+def bench_downlink_wait(iterations, rx_delay=0.05):
+    # time between the RX_SUCCESS indication leaving the modem and the
+    # downlink data being returned by send_data
+    with FakeModem(tx_delay=0.0, rx_delay=rx_delay) as modem:
+        sensor = MiotySensor(BAUDRATE, modem.port, verbose=False)
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            received_data = sensor.send_data("a1b2c3", 5, 0.5, False)
+            if received_data:
+                latencies.append(time.perf_counter() - start - rx_delay)
+        sensor.close()
+
+    result = _latency_stats(latencies)
+    result["rx_delay"] = rx_delay
+
+    return result
+
+
+def _uplink_document(index):
+    # shaped like an uplink message of the mioty service center
+    return json.dumps(
+        {
+            "id": 1000 + index,
+            "typeEui": "70-b3-d5-67-70-ff-00-01",
+            "cnt": index,
+            "format": 0,
+            "data": [(index + i) % 256 for i in range(20)],
+            "meta": {"packetType": "uplink", "subpackets": 3},
+            "baseStations": [
+                {
+                    "bsEui": "70-b3-d5-67-70-0e-00-{:02x}".format(bs),
+                    "rxTime": 1700000000000000000 + index,
+                    "freqOfs": 1234.5,
+                    "snr": 5.25 + bs,
+                    "rssi": -110.37 + bs,
+                    "eqSnr": 7.5 - bs,
+                    "profile": "eu1",
+                    "subpackets": {"snr": [5.1, 5.2, 5.3], "rssi": [-110.1, -110.2, -110.3]},
+                }
+                for bs in range(3)
+            ],
+        }
+    ).encode()
+
+
+def bench_uplink_json(iterations):
+    documents = [_uplink_document(i) for i in range(64)]
+    count = len(documents)
+
+    def measure(function):
+        start = time.perf_counter()
+        for i in range(iterations):
+            function(documents[i % count])
+        return _rate(iterations, time.perf_counter() - start)
+
+    data = [(-100 - i % 30, i % 100) for i in range(iterations)]
+
+    def measure_encode(function):
+        start = time.perf_counter()
+        for values in data:
+            function(values)
+        return _rate(iterations, time.perf_counter() - start)
+
+    return {
+        "codec": mqtt_codec.CODEC,
+        "decode_json_per_s": measure(mqtt_codec.decode_uplink_json),
+        "decode_codec_per_s": measure(mqtt_codec.decode_uplink),
+        "encode_json_per_s": measure_encode(
+            lambda values: json.dumps({"data": list(values), "format": 0, "presched": True})
+        ),
+        "encode_codec_per_s": measure_encode(mqtt_codec.encode_downlink),
+    }
+
+
+BENCHMARKS = {
+    "crc": lambda n: bench_crc(n * 10),
+    "encode": lambda n: bench_encode(n * 10),
+    "decode": lambda n: bench_decode(n * 10),
+    "decode_corrupted": lambda n: bench_decode(n * 10, corrupt_every=10),
+    "round_trip": lambda n: bench_round_trip(n),
+    "downlink_wait": lambda n: bench_downlink_wait(max(n // 100, 5)),
+    "uplink_json": lambda n: bench_uplink_json(n * 10),
+}
+
+
+def run(names, iterations):
+    results = {
+        "python": platform.python_version(),
+        "iterations": iterations,
+        "benchmarks": {},
+    }
+
+    for name in names:
+        results["benchmarks"][name] = BENCHMARKS[name](iterations)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--iterations", type=int, required=False, default=2000)
+    parser.add_argument("-o", "--output", type=str, required=False, help="JSON file, default: stdout")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help="any of {}, default: all".format(", ".join(BENCHMARKS)),
+    )
+
+    console_args = parser.parse_args()
+
+    for name in console_args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: {}".format(name))
+
+    results = run(console_args.benchmarks or list(BENCHMARKS), console_args.iterations)
+
+    if console_args.output:
+        with open(console_args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
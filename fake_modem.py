@@ -0,0 +1,164 @@
+# /usr/bin/env
+
+from satp_serial import MiotySerialSATP as SSATP
+from satp_serial import SATPDecoder, pack_frame
+import heapq
+import itertools
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+
+class FakeModem:
+    # simulated mioty module behind a pseudo terminal (POSIX only), port can
+    # be opened like a real serial port, e.g. MiotySerialSATP(115200, modem.port)
+    #
+    # - every CMD frame is answered with a confirmation
+    # - SATP_STACK_NB_SEND is followed by E_STACK_EVENT_TX_SUCCESS after
+    #   tx_delay and, if rx_delay is not None, by E_STACK_EVENT_RX_SUCCESS
+    #   rx_delay later
+    # - every corrupt_every-th frame sent to the host has a broken CRC and is
+    #   followed by a few bytes of garbage
+
+    def __init__(self, tx_delay=0.0, rx_delay=None, corrupt_every=0, downlink=b"\x01\x02\x03\x04"):
+        self.tx_delay = tx_delay
+        self.rx_delay = rx_delay
+        self.corrupt_every = corrupt_every
+        self.downlink = downlink
+
+        self.params = {
+            SSATP.E_STACK_PARAM_ID_MIOTY_PROFILE: b"\x00",
+            SSATP.E_STACK_PARAM_ID_MIOTY_MODE: b"\x00",
+            SSATP.E_STACK_PARAM_ID_MIOTY_EUI64: b"\x70\xb3\xd5\x67\x70\x00\x00\x01",
+            SSATP.E_STACK_PARAM_ID_MIOTY_NWKKEY: bytes(16),
+            SSATP.E_STACK_PARAM_ID_MIOTY_SHORT_ADDR: b"\x00\x01",
+            SSATP.E_STACK_PARAM_ID_MIOTY_TX_POWER: b"\x0e",
+        }
+        self.active_stack = SSATP.E_STACK_ID_NONE
+
+        self.frames_received = 0
+        self.frames_sent = 0
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self._decoder = SATPDecoder()
+        self._scheduled = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        os.write(self._wakeup_w, b"\x00")
+        self._thread.join()
+        for fd in (self.master, self.slave, self._wakeup_r, self._wakeup_w):
+            os.close(fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def indicate(self, event, delay=0.0):
+        self._schedule(delay, SSATP.API_SATP_STACK_IND, SSATP.SATP_STACK_IND_GEN, bytes((event,)))
+
+    def _schedule(self, delay, api_id, command, parameter):
+        with self._lock:
+            heapq.heappush(
+                self._scheduled,
+                (time.monotonic() + delay, next(self._sequence), api_id, command, parameter),
+            )
+        os.write(self._wakeup_w, b"\x00")
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                timeout = None
+                if self._scheduled:
+                    timeout = max(self._scheduled[0][0] - time.monotonic(), 0)
+
+            readable, _, _ = select.select([self.master, self._wakeup_r], [], [], timeout)
+
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 4096)
+            if self.master in readable:
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    return
+                for frame in self._decoder.feed(data):
+                    self.frames_received += 1
+                    self._handle(frame)
+
+            now = time.monotonic()
+            while True:
+                with self._lock:
+                    if not self._scheduled or self._scheduled[0][0] > now:
+                        break
+                    _, _, api_id, command, parameter = heapq.heappop(self._scheduled)
+                self._write(api_id, command, parameter)
+
+    def _handle(self, frame):
+        _, api_id, command, parameter = frame
+        parameter = parameter or b""
+
+        if api_id != SSATP.API_SATP_STACK_CMD:
+            return
+
+        status = SSATP.E_STACK_RETURN_SUCCESS
+        data = b""
+
+        if command == SSATP.SATP_STACK_GET:
+            if parameter and parameter[0] in self.params:
+                data = self.params[parameter[0]]
+            else:
+                status = SSATP.E_STACK_RETURN_ERROR_INVALID_PARAM
+        elif command == SSATP.SATP_STACK_SET:
+            if parameter and parameter[0] in self.params:
+                self.params[parameter[0]] = bytes(parameter[1:])
+                self.indicate(SSATP.E_STACK_EVENT_PERSISTENT_DATA_UPDATE)
+            else:
+                status = SSATP.E_STACK_RETURN_ERROR_INVALID_PARAM
+        elif command == SSATP.SATP_STACK_SELECT_STACK:
+            self.active_stack = parameter[0] if parameter else SSATP.E_STACK_ID_NONE
+        elif command == SSATP.SATP_STACK_GET_ACTIVE_STACK:
+            data = bytes((self.active_stack,))
+        elif command == SSATP.SATP_STACK_RECEIVE:
+            data = self.downlink
+        elif command == SSATP.SATP_STACK_NB_SEND:
+            self.indicate(SSATP.E_STACK_EVENT_TX_SUCCESS, self.tx_delay)
+            if self.rx_delay is not None:
+                self.indicate(SSATP.E_STACK_EVENT_RX_SUCCESS, self.tx_delay + self.rx_delay)
+
+        if status != SSATP.E_STACK_RETURN_SUCCESS:
+            self._write(SSATP.API_SATP_STACK_CMD, SSATP.E_STACK_RETURN_ERROR, bytes((status,)))
+        else:
+            self._write(SSATP.API_SATP_STACK_CMD, status, data)
+
+    def _write(self, api_id, command, parameter):
+        frame = pack_frame(api_id, command, parameter)
+
+        self.frames_sent += 1
+        if self.corrupt_every and self.frames_sent % self.corrupt_every == 0:
+            frame = frame[:-1] + bytes(((frame[-1] ^ 0xFF),)) + b"\x00\xa5\x13"
+
+        os.write(self.master, frame)
+
+
+if __name__ == "__main__":
+    with FakeModem(tx_delay=0.5, rx_delay=1.0) as modem:
+        print(modem.port)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,177 @@
+# /usr/bin/env
+
+# link quality of the uplinks per endpoint and base station, kept in
+# preallocated NumPy ring buffers (memory is fixed by series and window)
+#
+# - record() is O(1) per base station report, it only writes the last window
+#   values of rssi, snr and eqSnr into the ring of the (endpoint, base
+#   station) series and updates the packet counters of the endpoint
+# - snapshot() computes mean and percentiles of all series at once and the
+#   packet loss of every endpoint from the gaps of its packet counter
+#
+# if more than series (endpoint, base station) pairs or endpoints are seen,
+# the least recently updated one is reused
+#
+#   pip install numpy
+
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+SERIES = 16384
+WINDOW = 64
+PERCENTILES = (10, 50, 90)
+
+VALUES = ("rssi", "snr", "eqSnr")
+
+# a packet counter this far below the last one is taken as a restart of the
+# endpoint, a smaller step back as a late telegram
+COUNTER_RESET = 1024
+
+
+class _Slots:
+    # maps keys to rows of the preallocated arrays, LRU if full
+    def __init__(self, size):
+        self.size = size
+        self.rows = OrderedDict()
+
+    def get(self, key):
+        # returns (row, new)
+        row = self.rows.get(key)
+        if row is not None:
+            self.rows.move_to_end(key)
+            return row, False
+
+        if len(self.rows) < self.size:
+            row = len(self.rows)
+        else:
+            _, row = self.rows.popitem(last=False)
+        self.rows[key] = row
+
+        return row, True
+
+
+class LinkAnalytics:
+    def __init__(self, series=SERIES, window=WINDOW, percentiles=PERCENTILES):
+        self.window = window
+        self.percentiles = percentiles
+        self.lock = threading.Lock()
+
+        self.series = _Slots(series)
+        # rssi, snr, eqSnr of the last window reports of every series
+        self.values = np.full((len(VALUES), series, window), np.nan, dtype=np.float32)
+        self.samples = np.zeros(series, dtype=np.int64)
+        self.last_seen = np.zeros(series, dtype=np.float64)
+
+        self.endpoints = _Slots(series)
+        self.first_cnt = np.zeros(series, dtype=np.int64)
+        self.last_cnt = np.zeros(series, dtype=np.int64)
+        self.received = np.zeros(series, dtype=np.int64)
+
+    def record(self, endpoint, cnt, basestations):
+        # cnt None only records the reports, e.g. those of further base
+        # stations of a telegram that was already counted
+        now = time.time()
+
+        with self.lock:
+            if cnt is not None:
+                row, new = self.endpoints.get(endpoint)
+                if new or cnt < self.last_cnt[row] - COUNTER_RESET:
+                    self.first_cnt[row] = cnt
+                    self.last_cnt[row] = cnt
+                    self.received[row] = 1
+                else:
+                    self.received[row] += 1
+                    if cnt > self.last_cnt[row]:
+                        self.last_cnt[row] = cnt
+                    elif cnt < self.first_cnt[row]:
+                        self.first_cnt[row] = cnt
+
+            for basestation in basestations:
+                row, new = self.series.get((endpoint, basestation.bsEui))
+                if new:
+                    self.values[:, row, :] = np.nan
+                    self.samples[row] = 0
+                self.values[:, row, self.samples[row] % self.window] = (basestation.rssi, basestation.snr, basestation.eqSnr)
+                self.samples[row] += 1
+                self.last_seen[row] = now
+
+    def snapshot(self):
+        with self.lock:
+            series = list(self.series.rows.items())
+            endpoints = list(self.endpoints.rows.items())
+            rows = np.fromiter((row for _, row in series), dtype=np.int64, count=len(series))
+            values = self.values[:, rows, :].copy()
+            samples = self.samples[rows].copy()
+            last_seen = self.last_seen[rows].copy()
+            endpoint_rows = np.fromiter((row for _, row in endpoints), dtype=np.int64, count=len(endpoints))
+            first_cnt = self.first_cnt[endpoint_rows].copy()
+            last_cnt = self.last_cnt[endpoint_rows].copy()
+            received = self.received[endpoint_rows].copy()
+
+        result = {}
+
+        expected = last_cnt - first_cnt + 1
+        loss = np.clip(1.0 - received / np.maximum(expected, 1), 0.0, 1.0)
+        for index, (endpoint, _) in enumerate(endpoints):
+            result[endpoint] = {
+                "received": int(received[index]),
+                "expected": int(expected[index]),
+                "loss": float(loss[index]),
+                "baseStations": {},
+            }
+
+        if len(series):
+            # every series has at least one value, the unused slots are NaN
+            # and are sorted to the end, the percentiles are interpolated
+            # between the sorted values like numpy.percentile() does
+            filled = np.minimum(samples, self.window)
+            means = np.nansum(values, axis=2) / filled
+            values.sort(axis=2)
+
+            percentiles = []
+            for percentile in self.percentiles:
+                position = (filled - 1) * (percentile / 100.0)
+                lower = np.floor(position).astype(np.int64)
+                upper = np.minimum(lower + 1, filled - 1)
+                fraction = (position - lower).astype(np.float32)
+                low = np.take_along_axis(values, np.broadcast_to(lower[None, :, None], (len(VALUES), len(series), 1)), axis=2)[:, :, 0]
+                high = np.take_along_axis(values, np.broadcast_to(upper[None, :, None], (len(VALUES), len(series), 1)), axis=2)[:, :, 0]
+                percentiles.append(low + (high - low) * fraction)
+
+            # Python floats in one go, much faster than per element
+            means = means.tolist()
+            percentiles = np.stack(percentiles).tolist()
+            samples = samples.tolist()
+            last_seen = last_seen.tolist()
+            names = ["p{}".format(percentile) for percentile in self.percentiles]
+
+            for index, ((endpoint, bs_eui), _) in enumerate(series):
+                report = {
+                    "samples": samples[index],
+                    "last_seen": last_seen[index],
+                }
+                for value_index, name in enumerate(VALUES):
+                    stats = {"mean": means[value_index][index]}
+                    for percentile_index, percentile_name in enumerate(names):
+                        stats[percentile_name] = percentiles[percentile_index][value_index][index]
+                    report[name] = stats
+
+                endpoint_report = result.setdefault(endpoint, {"baseStations": {}})
+                endpoint_report["baseStations"][bs_eui or "unknown"] = report
+
+        return result
+
+    def write(self, path):
+        # written to a temporary file first, readers never see a partial file
+        snapshot = self.snapshot()
+        temporary = path + ".tmp"
+        with open(temporary, "w") as snapshot_file:
+            json.dump({"time": time.time(), "endpoints": snapshot}, snapshot_file)
+        os.replace(temporary, path)
+
+        return snapshot
@@ -0,0 +1,133 @@
+# /usr/bin/env
+
+# closed loop TX power control from the RSSI echo of mioty_mqtt_script.py
+#
+# the RSSI of the best base station, sent back in the downlink, is averaged
+# over window telegrams; its margin above sensitivity is kept at
+# target_margin by lowering or raising E_STACK_PARAM_ID_MIOTY_TX_POWER, the
+# power only changes when the margin is more than hysteresis dB off
+#
+# mode and profile are only changed if a ladder of (mode, profile) pairs is
+# given, ordered from the most efficient to the most robust one: at maximum
+# power the next more robust pair is used, with a margin of ladder_gain dB
+# above the target the next more efficient one; profiles are regional
+# channel plans, only list the ones that are allowed for the deployment
+#
+#   controller = AdaptiveTxController(sensor)
+#   controller.update(decode_rssi_echo(received_data))
+
+from collections import deque
+import math
+
+RSSI_SENSITIVITY = -135.0
+TARGET_MARGIN = 10.0
+HYSTERESIS = 3.0
+WINDOW = 5
+
+TX_POWER_MIN = 0
+TX_POWER_MAX = 14
+
+LADDER_GAIN = 6.0
+
+
+def decode_rssi_echo(data):
+    # downlink of mioty_mqtt_script.py: integer part and hundredths of the
+    # RSSI in dBm; the RSSI is never positive, so the first byte is taken as
+    # -256..-1 and not as a signed byte, which would wrap below -128 dBm
+    if not data or len(data) < 2:
+        return None
+
+    return data[0] - 256 - data[1] / 100
+
+
+class AdaptiveTxController:
+    def __init__(
+        self,
+        sensor,
+        sensitivity=RSSI_SENSITIVITY,
+        target_margin=TARGET_MARGIN,
+        hysteresis=HYSTERESIS,
+        window=WINDOW,
+        tx_power_min=TX_POWER_MIN,
+        tx_power_max=TX_POWER_MAX,
+        ladder=(),
+        ladder_gain=LADDER_GAIN,
+        snr_min=None,
+    ):
+        self.sensor = sensor
+        self.sensitivity = sensitivity
+        self.target_margin = target_margin
+        self.hysteresis = hysteresis
+        self.tx_power_min = tx_power_min
+        self.tx_power_max = tx_power_max
+        self.ladder = list(ladder)
+        self.ladder_gain = ladder_gain
+        self.snr_min = snr_min
+
+        self.samples = deque(maxlen=window)
+
+        # the current settings of the module (from the parameter cache)
+        current = sensor.get_set_params(True, True if self.ladder else None, True if self.ladder else None)
+        self.tx_power = current.get("tx_power", tx_power_max)
+        self.step = 0
+        if (current.get("mioty_mode"), current.get("mioty_profile")) in self.ladder:
+            self.step = self.ladder.index((current["mioty_mode"], current["mioty_profile"]))
+
+    def update(self, rssi, snr=None):
+        # returns the applied settings if they were changed, otherwise None
+        if rssi is None:
+            return None
+
+        self.samples.append((rssi, snr))
+        if len(self.samples) < self.samples.maxlen:
+            return None
+
+        error = sum(sample[0] for sample in self.samples) / len(self.samples) - self.sensitivity - self.target_margin
+
+        snrs = [sample[1] for sample in self.samples if sample[1] is not None]
+        if self.snr_min is not None and snrs:
+            # too little SNR counts like too little margin
+            error = min(error, sum(snrs) / len(snrs) - self.snr_min)
+
+        if abs(error) <= self.hysteresis:
+            return None
+
+        tx_power = self.tx_power
+        step = self.step
+
+        if error > 0:
+            if step > 0 and error >= self.ladder_gain + self.hysteresis:
+                step -= 1
+            else:
+                tx_power = max(tx_power - int(error), self.tx_power_min)
+        else:
+            needed = math.ceil(-error)
+            if tx_power + needed <= self.tx_power_max or step >= len(self.ladder) - 1:
+                tx_power = min(tx_power + needed, self.tx_power_max)
+            else:
+                step += 1
+                tx_power = self.tx_power_max
+
+        if tx_power == self.tx_power and step == self.step:
+            return None
+
+        return self.apply(tx_power, step)
+
+    def apply(self, tx_power, step=0):
+        mode, profile = self.ladder[step] if self.ladder else (None, None)
+
+        result = self.sensor.get_set_params(
+            tx_power & 0xFF if tx_power != self.tx_power else None,
+            mode if step != self.step else None,
+            profile if step != self.step else None,
+        )
+
+        if "tx_power" in result:
+            self.tx_power = result["tx_power"]
+        if self.ladder and "mioty_mode" in result and "mioty_profile" in result:
+            self.step = step
+
+        # the samples were measured with the old settings
+        self.samples.clear()
+
+        return {"tx_power": self.tx_power, "step": self.step}
@@ -0,0 +1,159 @@
+# /usr/bin/env
+
+# finds the mioty modules among the serial ports: every candidate port is
+# probed in parallel with SATP_STACK_GET_ACTIVE_STACK and a GET of the EUI64,
+# with a short timeout; the port -> EUI64 map is cached in DISCOVERY_CACHE
+# (~/.mioty_ports.json or $MIOTY_PORTS), so modules can be addressed by
+# EUI64 instead of by port
+#
+#   miotysensor discover [--ports PORT ...] [-t TIMEOUT]
+#   miotysensor --port 70-b3-d5-67-70-00-00-01 params --txPower
+
+from satp_serial import MiotySerialSATP as SSATP
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import os
+import platform
+import time
+
+DISCOVERY_CACHE = os.environ.get("MIOTY_PORTS", os.path.join(os.path.expanduser("~"), ".mioty_ports.json"))
+PROBE_TIMEOUT = 0.3
+PROBE_WORKERS = 32
+
+if platform.system() == "Windows":
+    PORT_PATTERNS = []
+else:
+    PORT_PATTERNS = ["/dev/ttyACM*", "/dev/ttyUSB*"]
+
+
+def normalize_eui64(eui):
+    return eui.replace("-", "").replace(":", "").lower()
+
+
+def format_eui64(eui):
+    eui = normalize_eui64(eui)
+    return "-".join(eui[i : i + 2] for i in range(0, len(eui), 2))
+
+
+def is_eui64(value):
+    value = normalize_eui64(value)
+    return len(value) == 16 and all(c in "0123456789abcdef" for c in value)
+
+
+def candidate_ports():
+    # all ports known to pyserial, plus the usual USB CDC/serial device nodes
+    ports = []
+    try:
+        from serial.tools import list_ports
+
+        ports = [port.device for port in list_ports.comports()]
+    except ImportError:
+        pass
+
+    for pattern in PORT_PATTERNS:
+        for port in sorted(glob.glob(pattern)):
+            if port not in ports:
+                ports.append(port)
+
+    return ports
+
+
+def probe(port, baudrate=115200, timeout=PROBE_TIMEOUT):
+    # returns the EUI64 of the module on port, or None; read-only, a module
+    # running another stack is skipped and no stack is selected, so a module
+    # without active stack is only found if it answers the GET anyway
+    return _probe(port, baudrate, timeout)[1]
+
+
+def _probe(port, baudrate, timeout):
+    # (opened, EUI64 or None); a port that fails to open, e.g. because
+    # another process holds it, is not opened
+    try:
+        satp = SSATP(baudrate, port, timeout)
+    except Exception:
+        return False, None
+
+    try:
+        active = satp.send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET_ACTIVE_STACK)
+        if active is None or active[2] != 0:
+            return True, None
+        if active[3] and active[3][0] not in (SSATP.E_STACK_ID_MIOTY, SSATP.E_STACK_ID_NONE):
+            return True, None
+
+        parameter = bytes((SSATP.E_STACK_PARAM_ID_MIOTY_EUI64,))
+        confirmation = satp.send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, parameter)
+
+        if confirmation is None or confirmation[2] != 0 or not confirmation[3]:
+            return True, None
+
+        return True, format_eui64(confirmation[3].hex())
+    except Exception:
+        return True, None
+    finally:
+        satp.close()
+
+
+def discover(ports=None, baudrate=115200, timeout=PROBE_TIMEOUT, exclude=(), cache_path=DISCOVERY_CACHE):
+    # returns {port: EUI64} of every probed port with a module; the result is
+    # merged into the cache, entries of the ports that were not probed or
+    # failed to open (in use) are kept unless their module was found on
+    # another port
+    if ports is None:
+        ports = candidate_ports()
+    ports = [port for port in ports if port not in exclude]
+
+    found = {}
+    probed = set()
+    if ports:
+        with ThreadPoolExecutor(max_workers=min(len(ports), PROBE_WORKERS)) as executor:
+            for port, (opened, eui64) in zip(ports, executor.map(lambda port: _probe(port, baudrate, timeout), ports)):
+                if opened:
+                    probed.add(port)
+                if eui64:
+                    found[port] = eui64
+
+    if cache_path:
+        moved = {normalize_eui64(eui64) for eui64 in found.values()}
+        cached = {
+            port: eui64
+            for port, eui64 in read_cache(cache_path).items()
+            if port not in probed and normalize_eui64(eui64) not in moved
+        }
+        cached.update(found)
+
+        with open(cache_path, "w") as cache_file:
+            json.dump({"time": time.time(), "ports": cached}, cache_file, indent=4)
+
+    return found
+
+
+def read_cache(cache_path=DISCOVERY_CACHE):
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, "r") as cache_file:
+        return json.load(cache_file).get("ports", {})
+
+
+def resolve_port(value, baudrate=115200, cache_path=DISCOVERY_CACHE):
+    # returns value unchanged if it is a port name, the port of the module
+    # if it is an EUI64; a cached port is only used after a probe confirmed
+    # the EUI64 (port numbers are reassigned after a re-plug), otherwise or
+    # for an unknown EUI64 a new discovery is started
+    if not is_eui64(value):
+        return value
+
+    eui64 = normalize_eui64(value)
+
+    for port, known in read_cache(cache_path).items():
+        if normalize_eui64(known) == eui64:
+            found = probe(port, baudrate)
+            if found and normalize_eui64(found) == eui64:
+                return port
+            break
+
+    for port, known in discover(baudrate=baudrate, cache_path=cache_path).items():
+        if normalize_eui64(known) == eui64:
+            return port
+
+    raise LookupError("no module with EUI64 {} found".format(format_eui64(eui64)))
@@ -0,0 +1,328 @@
+# /usr/bin/env
+
+from miotysensor import MiotySensor, BAUDRATE
+from miotysensor import NetworkKey, SignedByte, MiotyMode, MiotyProfile
+from satp_serial import MiotySerialSATP as SSATP
+from mioty_discovery import resolve_port
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
+import glob
+import json
+import time
+
+RESULT_FIELDS = [
+    "port",
+    "eui64",
+    "short_addr",
+    "ok",
+    "error",
+    "identify",
+    "initialize",
+    "params",
+    "total",
+]
+
+
+def expand_ports(patterns):
+    # an EUI64 stands for the port of that module, see mioty_discovery.py
+    ports = []
+
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [resolve_port(pattern)]
+        for port in matches:
+            if port not in ports:
+                ports.append(port)
+
+    return ports
+
+
+def normalize_eui64(eui):
+    return eui.replace("-", "").replace(":", "").lower()
+
+
+def read_manifest(path):
+    # returns the rows, CSV with a header line and JSON Lines (".jsonl") are
+    # read one row at a time, a JSON array (".json") is read at once, so a
+    # malformed file fails before any device is opened; columns/keys: port
+    # or eui64, networkKey and the optional txPower, miotyMode, miotyProfile
+    if path.endswith(".json"):
+        with open(path, "r") as manifest_file:
+            rows = json.load(manifest_file)
+        if not isinstance(rows, list):
+            raise ValueError("{}: JSON array of rows expected".format(path))
+        return rows
+
+    return _read_rows(path)
+
+
+def _read_rows(path):
+    with open(path, "r", newline="") as manifest_file:
+        if path.endswith(".jsonl"):
+            for line in manifest_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(manifest_file)
+
+
+def parse_manifest_row(row):
+    def value(name, parse):
+        raw = row.get(name)
+        if raw is None or raw == "":
+            return None
+        return parse(str(raw))
+
+    return {
+        "port": row.get("port") or None,
+        "eui64": value("eui64", normalize_eui64),
+        "networkKey": value("networkKey", NetworkKey),
+        "txPower": value("txPower", SignedByte),
+        "miotyMode": value("miotyMode", MiotyMode),
+        "miotyProfile": value("miotyProfile", MiotyProfile),
+    }
+
+
+class MiotyFleet:
+    def __init__(self, ports, baudrate=BAUDRATE, max_workers=None, confirmation_timeout=SSATP.CONFIRMATION_TIMEOUT):
+        self.ports = expand_ports(ports)
+        self.baudrate = baudrate
+        self.confirmation_timeout = confirmation_timeout
+
+        # every device gets its own worker, a slow module must not delay the
+        # others
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or max(len(self.ports), 1))
+
+        self.sensors = {}
+
+    def close(self):
+        self.executor.shutdown()
+        for sensor in self.sensors.values():
+            sensor.close()
+        self.sensors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def sensor(self, port):
+        # the port is opened in the worker thread, so opening is parallel too
+        if port not in self.sensors:
+            self.sensors[port] = MiotySensor(self.baudrate, port, self.confirmation_timeout, verbose=False)
+        return self.sensors[port]
+
+    def run(self, action, *args, **kwargs):
+        # action is the name of a MiotySensor method or a callable that takes
+        # (sensor, port); the result contains one entry per port
+        start = time.monotonic()
+
+        futures = [self.executor.submit(self._run_one, port, action, args, kwargs) for port in self.ports]
+        devices = [future.result() for future in futures]
+
+        return {
+            "elapsed": time.monotonic() - start,
+            "devices": devices,
+        }
+
+    def initialize(self, nwkkey, tx_power=None, mioty_mode=None, mioty_profile=None):
+        def init(sensor, port):
+            result = sensor.initialize(nwkkey)
+            result.update(sensor.get_set_params(tx_power, mioty_mode, mioty_profile))
+            return result
+
+        return self.run(init)
+
+    def get_set_params(self, tx_power, mioty_mode, mioty_profile):
+        return self.run("get_set_params", tx_power, mioty_mode, mioty_profile)
+
+    def send_data(self, data, timeout, period, save_data=False):
+        return self.run("send_data", data, timeout, period, save_data)
+
+    def provision(self, rows, results_path=None):
+        # reads the EUI64 of every device, then streams the manifest rows and
+        # provisions each device as soon as its row is found; reading stops
+        # once every device has been matched
+        identities = self.run(lambda sensor, port: sensor.read_eui64())
+
+        pending = {}
+        devices = []
+        for device in identities["devices"]:
+            if device["ok"] and device["result"]:
+                pending[device["port"]] = normalize_eui64(device["result"])
+            else:
+                devices.append(
+                    {
+                        "port": device["port"],
+                        "ok": False,
+                        "error": device.get("error", "EUI64 NOT AVAILABLE"),
+                        "identify": device["duration"],
+                    }
+                )
+        durations = {device["port"]: device["duration"] for device in identities["devices"]}
+
+        start = time.monotonic()
+        futures = []
+        for row in rows:
+            if not pending:
+                break
+            # the eui64 of a row decides the match, the port only for rows
+            # without eui64
+            row_port = row.get("port") or None
+            row_eui64 = normalize_eui64(str(row.get("eui64") or ""))
+            for port, eui64 in pending.items():
+                if row_eui64 and row_eui64 == eui64 and row_port and row_port != port:
+                    # stale port column, no key is written
+                    del pending[port]
+                    devices.append(
+                        {
+                            "port": port,
+                            "eui64": eui64,
+                            "ok": False,
+                            "error": "PORT CONFLICT: MANIFEST PORT {}".format(row_port),
+                            "identify": durations[port],
+                        }
+                    )
+                    break
+                if (row_eui64 and row_eui64 == eui64) or (not row_eui64 and row_port == port):
+                    del pending[port]
+                    futures.append(
+                        self.executor.submit(self._provision_one, port, eui64, durations[port], row)
+                    )
+                    break
+
+        for port, eui64 in pending.items():
+            devices.append(
+                {
+                    "port": port,
+                    "eui64": eui64,
+                    "ok": False,
+                    "error": "NOT IN MANIFEST",
+                    "identify": durations[port],
+                }
+            )
+        devices += [future.result() for future in futures]
+
+        if results_path:
+            with open(results_path, "w", newline="") as results_file:
+                writer = csv.DictWriter(results_file, RESULT_FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(devices)
+
+        return {
+            "elapsed": time.monotonic() - start + max(durations.values(), default=0),
+            "devices": devices,
+        }
+
+    def _provision_one(self, port, eui64, identify, row):
+        device = {"port": port, "eui64": eui64, "identify": identify}
+        sensor = self.sensors[port]
+
+        try:
+            row = parse_manifest_row(row)
+            if row["networkKey"] is None:
+                raise ValueError("networkKey missing")
+
+            failures = sensor.failures
+
+            start = time.monotonic()
+            result = sensor.initialize(row["networkKey"])
+            device["initialize"] = time.monotonic() - start
+            device["short_addr"] = result.get("short_addr")
+
+            start = time.monotonic()
+            sensor.get_set_params(row["txPower"], row["miotyMode"], row["miotyProfile"])
+            device["params"] = time.monotonic() - start
+
+            device["ok"] = sensor.failures == failures
+            if not device["ok"]:
+                device["error"] = "{} STEP(S) FAILED".format(sensor.failures - failures)
+        except Exception as e:
+            device["ok"] = False
+            device["error"] = "{}: {}".format(type(e).__name__, e)
+
+        device["total"] = identify + device.get("initialize", 0) + device.get("params", 0)
+
+        return device
+
+    def _run_one(self, port, action, args, kwargs):
+        start = time.monotonic()
+        device = {"port": port}
+
+        try:
+            sensor = self.sensor(port)
+            if callable(action):
+                result = action(sensor, port, *args, **kwargs)
+            else:
+                result = getattr(sensor, action)(*args, **kwargs)
+            if isinstance(result, (bytes, bytearray)):
+                result = result.hex()
+            device["ok"] = True
+            device["result"] = result
+        except Exception as e:
+            device["ok"] = False
+            device["error"] = "{}: {}".format(type(e).__name__, e)
+
+        device["duration"] = time.monotonic() - start
+
+        return device
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--ports",
+        nargs="+",
+        required=True,
+        help="port names, glob patterns, e.g. '/dev/ttyACM*', or EUI64s",
+    )
+    parser.add_argument("--workers", type=int, required=False)
+
+    subparses = parser.add_subparsers(dest="function", required=True)
+
+    parser_init = subparses.add_parser("init")
+    parser_init.add_argument("networkKey", type=NetworkKey)
+
+    parser_params = subparses.add_parser("params")
+
+    for subparser in (parser_init, parser_params):
+        subparser.add_argument("--txPower", nargs="?", type=SignedByte, required=False, const=True)
+        subparser.add_argument("--miotyMode", nargs="?", type=MiotyMode, required=False, const=True)
+        subparser.add_argument("--miotyProfile", nargs="?", type=MiotyProfile, required=False, const=True)
+
+    parser_provision = subparses.add_parser("provision")
+    parser_provision.add_argument("manifest", type=str)
+    parser_provision.add_argument("-r", "--results", type=str, required=False, default="provision_results.csv")
+
+    parser_send = subparses.add_parser("send")
+    parser_send.add_argument("--data", type=str, required=True)
+    parser_send.add_argument("-t", "--timeout", type=float, required=False, default=30)
+    parser_send.add_argument("-p", "--period", type=float, required=False, default=0.5)
+
+    console_args = parser.parse_args()
+
+    with MiotyFleet(console_args.ports, max_workers=console_args.workers) as fleet:
+        if console_args.function == "init":
+            results = fleet.initialize(
+                console_args.networkKey,
+                console_args.txPower,
+                console_args.miotyMode,
+                console_args.miotyProfile,
+            )
+        elif console_args.function == "params":
+            results = fleet.get_set_params(
+                console_args.txPower,
+                console_args.miotyMode,
+                console_args.miotyProfile,
+            )
+        elif console_args.function == "provision":
+            results = fleet.provision(read_manifest(console_args.manifest), console_args.results)
+        elif console_args.function == "send":
+            results = fleet.send_data(console_args.data, console_args.timeout, console_args.period)
+
+    print(json.dumps(results, indent=4))
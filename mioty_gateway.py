@@ -0,0 +1,184 @@
+# /usr/bin/env
+
+# long running serial to MQTT gateway, keeps the SATP port open and
+#
+# - sends every payload published to <prefix>/uplink (hex string) with
+#   SATP_STACK_NB_SEND and publishes the result to <prefix>/status, a
+#   payload that is not a hex string only {"status": "INVALID"}
+# - publishes every indication to <prefix>/indication
+# - reads the downlink after E_STACK_EVENT_RX_SUCCESS and publishes it to
+#   <prefix>/downlink
+#
+# - with adaptive, passes the RSSI echo of every downlink (see
+#   mioty_mqtt_script.py) to an AdaptiveTxController and publishes changed
+#   settings to <prefix>/adaptive
+# - publishes the link metrics (satp.metrics.snapshot()) to <prefix>/metrics
+#   every METRICS_PERIOD seconds
+#
+# <prefix> is mioty_gateway/<EUI64> by default
+
+from miotysensor import MiotySensor, BAUDRATE, PORT_DEFAULT, ComPort
+from satp_serial import MiotySerialSATP as SSATP
+import paho.mqtt.client as paho
+from collections import deque
+import argparse
+import json
+import queue
+import time
+
+MQTT_IP = "192.168.10.177"
+MQTT_PORT = 1883
+TOPIC_PREFIX = "mioty_gateway"
+UPLINK_QUEUE_SIZE = 256
+METRICS_PERIOD = 60
+
+EVENT_NAMES = SSATP.EVENT_NAMES
+
+
+class MiotyGateway:
+    def __init__(self, port, mqtt_ip, mqtt_port, prefix=None, rx_window=True, baudrate=BAUDRATE, adaptive=None):
+        self.sensor = MiotySensor(baudrate, port, verbose=False)
+        self.satp = self.sensor.satp
+        self.rx_window = rx_window
+
+        # adaptive is None or the keyword arguments of AdaptiveTxController
+        self.controller = None
+        if adaptive is not None:
+            from mioty_adaptive import AdaptiveTxController
+
+            self.controller = AdaptiveTxController(self.sensor, **adaptive)
+
+        eui64 = self.sensor.read_eui64()
+        self.prefix = prefix or "{}/{}".format(TOPIC_PREFIX, eui64 or port.replace("/", "_"))
+
+        # written by the serial reader and paho's network thread, consumed
+        # only by the serial loop in run()
+        self.events = deque()
+        self.uplinks = queue.Queue(maxsize=UPLINK_QUEUE_SIZE)
+        self.satp.on_indication = self.events.append
+
+        self.client = paho.Client(
+            client_id="mioty_gateway_" + (eui64 or "").replace("-", ""),
+            userdata=None,
+            transport="tcp",
+            protocol=paho.MQTTv5,
+        )
+        self.client.on_connect = self.on_connect
+        self.client.message_callback_add(self.prefix + "/uplink", self.on_uplink)
+        self.client.connect(mqtt_ip, port=mqtt_port)
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        client.subscribe(self.prefix + "/uplink")
+
+    def on_uplink(self, client, userdata, message):
+        if message.retain:
+            return
+        # a malformed payload must not reach the serial loop in run()
+        try:
+            data = message.payload.decode().strip()
+            self.sensor.hex_string2bytes(data)
+        except ValueError:
+            self._publish("status", {"status": "INVALID"})
+            return
+        try:
+            self.uplinks.put_nowait(data)
+        except queue.Full:
+            self._publish("status", {"status": "DROPPED"})
+
+    def run(self):
+        self.client.loop_start()
+
+        last_metrics = time.monotonic()
+        try:
+            while True:
+                # blocks at most SSATP.READ_TIMEOUT
+                self.satp.poll()
+
+                if time.monotonic() - last_metrics >= METRICS_PERIOD:
+                    last_metrics = time.monotonic()
+                    self._publish("metrics", self.satp.metrics.snapshot())
+
+                while self.events:
+                    self._handle_indication(self.events.popleft())
+
+                while not self.uplinks.empty():
+                    self._send(self.uplinks.get_nowait())
+        finally:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.sensor.close()
+
+    def _send(self, data):
+        self.sensor.set_send_params(bytes((SSATP.E_STACK_SEND_PARAM_ID_MIOTY_RX_WINDOW, 0x01 if self.rx_window else 0x00)))
+
+        start = time.monotonic()
+        confirmation = self.satp.send_with_confirmation(
+            SSATP.API_SATP_STACK_CMD,
+            SSATP.SATP_STACK_NB_SEND,
+            self.sensor.hex_string2bytes(data),
+        )
+        if confirmation is None:
+            status = "TIMEOUT"
+        elif confirmation[2] == 0:
+            status = "OK"
+        else:
+            status = "ERROR"
+
+        self._publish(
+            "status",
+            {"data": data, "status": status, "latency": time.monotonic() - start},
+        )
+
+    def _handle_indication(self, message):
+        event = message[3][0] if message[3] else None
+
+        self._publish("indication", {"event": EVENT_NAMES.get(event, event)})
+
+        if event == SSATP.E_STACK_EVENT_RX_SUCCESS:
+            confirmation = self.satp.send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_RECEIVE)
+            if confirmation and confirmation[2] == 0 and confirmation[3]:
+                self._publish("downlink", {"data": confirmation[3].hex()})
+
+                if self.controller:
+                    from mioty_adaptive import decode_rssi_echo
+
+                    settings = self.controller.update(decode_rssi_echo(confirmation[3]))
+                    if settings:
+                        self._publish("adaptive", settings)
+
+    def _publish(self, topic, message):
+        self.client.publish(self.prefix + "/" + topic, json.dumps(message))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--port", type=ComPort, required=False, default=PORT_DEFAULT)
+    parser.add_argument("--mqtt_ip", type=str, required=False, default=MQTT_IP)
+    parser.add_argument("--mqtt_port", type=int, required=False, default=MQTT_PORT)
+    parser.add_argument("--prefix", type=str, required=False, help="topic prefix, default: mioty_gateway/<EUI64>")
+    parser.add_argument("--no_rx_window",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument("--adaptive",
+        required=False,
+        action="store_true",
+        help="adapt the TX power to the RSSI echo of the downlinks",
+    )
+    parser.add_argument("--target_margin", type=float, required=False, help="dB above sensitivity, default: 10")
+
+    console_args = parser.parse_args()
+
+    from mioty_discovery import resolve_port
+
+    MiotyGateway(
+        resolve_port(console_args.port),
+        console_args.mqtt_ip,
+        console_args.mqtt_port,
+        console_args.prefix,
+        not console_args.no_rx_window,
+        adaptive=(
+            {"target_margin": console_args.target_margin} if console_args.target_margin is not None else {}
+        ) if console_args.adaptive else None,
+    ).run()
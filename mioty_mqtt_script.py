@@ -1,67 +1,489 @@
 # /usr/bin/env
 
 import paho.mqtt.client as paho
+from mqtt_codec import decode_uplink, encode_downlink
+from collections import OrderedDict, deque
+import argparse
 import json
+import queue
+import threading
+import time
 from time import sleep
 
 DEBUG = True
 MQTT_IP = "192.168.10.177"
 MQTT_PORT = 1883
+UPLINK_TOPIC = "mioty/00-00-00-00-00-00-00-00/+/uplink"
 
+# uplinks are handled by a pool of workers instead of paho's network thread,
+# if the queue is full new uplinks are dropped, uplinks that waited longer
+# than MAX_MESSAGE_AGE seconds are dropped as their RX window is over
+WORKERS = 4
+QUEUE_SIZE = 256
+MAX_MESSAGE_AGE = 5.0
+METRICS_PERIOD = 10
 
-def on_connect(client, userdata, flags, reason_code, properties):
-    if DEBUG:
-        print(f"\nConnected\n    Result code: {reason_code}")
+# the same telegram (endpoint EUI + packet counter) received by several base
+# stations or retransmitted by the endpoint is answered only once
+DEDUP_TTL = 10.0
+DEDUP_SIZE = 4096
 
+# with a subscription like mioty/+/+/uplink every base station report of a
+# telegram arrives as its own message; the first one is held for
+# COALESCE_WINDOW seconds and rssi_echo answers the best report received
+# until then (0 answers the first message at once)
+COALESCE_WINDOW = 0.2
 
-def on_message(client, userdata, message):
-    if not message.retain:
-        basestation = json.loads(message.payload)["baseStations"][0]
+# link quality analytics (link_analytics.py, needs numpy), off by default,
+# e.g. "analytics": {"path": "link_analytics.json", "period": 60}; series
+# and window set the size of the ring buffers
+ANALYTICS_PERIOD = 60
 
-        rssi = basestation["rssi"]
-        eqSnr = basestation["eqSnr"]
-        snr = basestation["snr"]
+# the decode_payload handler decodes the uplink data with this schema (see
+# payload_codec.py), e.g. "schema": "payload_schema.example.json"
 
-        if DEBUG:
-            print(f"\nReceived data:")
-            print("    rssi: ", end="")
-            print(rssi)
-            print("    eqSnr: ", end="")
-            print(eqSnr)
-            print("    snr: ", end="")
-            print(snr)
-            print("\n")
+# settings used without a config file, a config file (see
+# mqtt_bridge.example.json) can list several brokers and subscriptions
+DEFAULT_CONFIG = {
+    "debug": DEBUG,
+    "workers": WORKERS,
+    "queue_size": QUEUE_SIZE,
+    "max_message_age": MAX_MESSAGE_AGE,
+    "metrics_period": METRICS_PERIOD,
+    "dedup_ttl": DEDUP_TTL,
+    "dedup_size": DEDUP_SIZE,
+    "coalesce_window": COALESCE_WINDOW,
+    "analytics": None,
+    "schema": None,
+    "brokers": {
+        "default": {
+            "host": MQTT_IP,
+            "port": MQTT_PORT,
+            "client_id": "py_mqtt_client",
+        },
+    },
+    "subscriptions": [
+        {
+            "broker": "default",
+            "topic": UPLINK_TOPIC,
+            "handler": "rssi_echo",
+        },
+    ],
+}
 
-        print([int(rssi), abs(int(round(rssi - int(rssi), 2) * 100))])
 
-        payload = {
-            "data": [int(rssi), abs(int(round(rssi - int(rssi), 2) * 100))],
-            "format": 0,
-            "presched":True
-        }
+class UplinkMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.expired = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
 
-        client.publish(
-            f"{"/".join(message.topic.split("/")[:3])}/downlink",
-            json.dumps(payload),
-        )
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
 
+    def handled_after(self, latency):
+        with self.lock:
+            self.handled += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
 
-if __name__ == "__main__":
+    def snapshot(self, queue_depth):
+        with self.lock:
+            return {
+                "queue_depth": queue_depth,
+                "received": self.received,
+                "handled": self.handled,
+                "dropped": self.dropped,
+                "expired": self.expired,
+                "duplicates": self.duplicates,
+                "errors": self.errors,
+                "latency_mean": self.latency_sum / self.handled if self.handled else 0.0,
+                "latency_max": self.latency_max,
+            }
+
+
+class UplinkDeduplicator:
+    # LRU of recently answered telegrams, entries expire after ttl seconds
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def first(self, key):
+        now = time.monotonic()
+
+        with self.lock:
+            entries = self.entries
+
+            while entries:
+                oldest_key, expires = next(iter(entries.items()))
+                if expires > now:
+                    break
+                del entries[oldest_key]
+
+            if key in entries:
+                entries.move_to_end(key)
+                return False
+
+            entries[key] = now + self.ttl
+            if len(entries) > self.size:
+                entries.popitem(last=False)
+
+            return True
+
+
+class UplinkCoalescer:
+    # collects the base station reports of a telegram that arrive within
+    # window seconds of the first one and then calls flush(context, reports)
+    # on the thread of run(); the window is the same for all telegrams, so
+    # they become due in the order of their first report
+    def __init__(self, window, deduplicator, flush):
+        self.window = window
+        self.deduplicator = deduplicator
+        self.flush = flush
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.due = deque()
+
+    def add(self, key, reports, context):
+        # returns True for the first report of a telegram, False if it was
+        # merged into a pending one or the telegram was already answered
+        with self.condition:
+            pending = self.pending.get(key)
+            if pending is not None:
+                pending[1].extend(reports)
+                return False
+
+            if not self.deduplicator.first(key):
+                return False
+
+            self.pending[key] = (context, list(reports))
+            self.due.append((time.monotonic() + self.window, key))
+            self.condition.notify()
+
+            return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.due:
+                    self.condition.wait()
+                due, key = self.due[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                self.due.popleft()
+                context, reports = self.pending.pop(key)
+
+            self.flush(context, reports)
+
+
+def load_config(path=None):
+    config = dict(DEFAULT_CONFIG)
+
+    if path:
+        with open(path, "r") as config_file:
+            config.update(json.load(config_file))
+
+    return config
+
+
+def create_client(name, settings):
     client = paho.Client(
-        client_id="py_mqtt_client",
+        client_id=settings.get("client_id", "py_mqtt_client_" + name),
         userdata=None,
-        transport="tcp",
+        transport=settings.get("transport", "tcp"),
         protocol=paho.MQTTv5,
     )
+    if settings.get("username"):
+        client.username_pw_set(settings["username"], settings.get("password"))
+
+    return client
+
+
+class ClientPool:
+    # one connection per broker address, shared by every subscription on it;
+    # factory(name, settings) creates the client, it can be replaced by a
+    # stand-in for tests; broker names with the same address must have the
+    # same settings, the connection is made with one client_id and login
+    def __init__(self, brokers, factory=create_client):
+        self.brokers = brokers
+        self.factory = factory
+        self.clients = {}
+        self.subscriptions = {}
+        self.settings = {}
+
+    def client(self, name):
+        settings = self.brokers[name]
+        address = (settings["host"], settings.get("port", 1883))
+
+        if address not in self.clients:
+            self.clients[address] = self.factory(name, settings)
+            self.subscriptions[address] = []
+            self.settings[address] = (name, settings)
+        elif self.settings[address][1] != settings:
+            raise ValueError(
+                "brokers {} and {} have the same address {}:{} but different settings".format(
+                    self.settings[address][0], name, *address
+                )
+            )
+
+        return self.clients[address], self.subscriptions[address]
+
+    def start(self):
+        for address, client in self.clients.items():
+            client.connect(address[0], port=address[1])
+            client.loop_start()
+
+    def stop(self):
+        for client in self.clients.values():
+            client.loop_stop()
+            client.disconnect()
+
+
+class MqttBridge:
+    def __init__(self, config, factory=create_client):
+        self.config = config
+        self.debug = config["debug"]
+
+        self.uplink_queue = queue.Queue(maxsize=config["queue_size"])
+        self.metrics = UplinkMetrics()
+        self.deduplicator = UplinkDeduplicator(config["dedup_ttl"], config["dedup_size"])
+        self.coalescer = UplinkCoalescer(config.get("coalesce_window", COALESCE_WINDOW), self.deduplicator, self._flush_echo)
+
+        self.analytics = None
+        if config.get("analytics"):
+            from link_analytics import LinkAnalytics
+
+            settings = config["analytics"]
+            self.analytics = LinkAnalytics(**{name: settings[name] for name in ("series", "window") if name in settings})
+
+        self.schema = None
+        if config.get("schema"):
+            from payload_codec import load_schema
+
+            self.schema = load_schema(config["schema"])
+
+        self.pool = ClientPool(config["brokers"], factory)
+
+        topics = set()
+        for subscription in config["subscriptions"]:
+            client, subscriptions = self.pool.client(subscription["broker"])
+            topic = subscription["topic"]
+            # paho keeps one callback per topic filter and connection
+            if (id(client), topic) in topics:
+                raise ValueError("topic {} is subscribed twice on broker {}".format(topic, subscription["broker"]))
+            topics.add((id(client), topic))
+            if subscription.get("share_group"):
+                # shared subscription, the broker splits the messages between
+                # all bridge processes of the group
+                topic = "$share/{}/{}".format(subscription["share_group"], topic)
+            subscriptions.append((topic, subscription.get("qos", 0)))
+            # messages of a shared subscription arrive with their real topic
+            client.message_callback_add(
+                subscription["topic"],
+                self._message_callback(HANDLERS[subscription.get("handler", "rssi_echo")]),
+            )
+
+        for client, subscriptions in zip(self.pool.clients.values(), self.pool.subscriptions.values()):
+            client.on_connect = self._connect_callback(subscriptions)
+
+    def start(self):
+        for _ in range(self.config["workers"]):
+            threading.Thread(target=self.uplink_worker, daemon=True).start()
+        if self.coalescer.window > 0:
+            threading.Thread(target=self.coalescer.run, daemon=True).start()
+
+        self.pool.start()
 
-    client.connect(MQTT_IP, port=MQTT_PORT)
+    def stop(self):
+        self.pool.stop()
 
-    client.on_connect = on_connect
-    client.on_message = on_message
+    def run(self):
+        self.start()
+
+        last_metrics = time.monotonic()
+        last_analytics = time.monotonic()
+        while True:
+            sleep(1)
+            if self.debug and time.monotonic() - last_metrics >= self.config["metrics_period"]:
+                last_metrics = time.monotonic()
+                print(f"\nMetrics: {self.metrics.snapshot(self.uplink_queue.qsize())}")
+            if self.analytics and time.monotonic() - last_analytics >= self.config["analytics"].get("period", ANALYTICS_PERIOD):
+                last_analytics = time.monotonic()
+                if self.config["analytics"].get("path"):
+                    self.analytics.write(self.config["analytics"]["path"])
+
+    def _connect_callback(self, subscriptions):
+        def on_connect(client, userdata, flags, reason_code, properties):
+            if self.debug:
+                print(f"\nConnected\n    Result code: {reason_code}")
+            # subscribing here renews the subscriptions after a reconnect
+            if subscriptions:
+                client.subscribe(subscriptions)
+
+        return on_connect
+
+    def _message_callback(self, handler):
+        def on_message(client, userdata, message):
+            if not message.retain:
+                self.metrics.count("received")
+                try:
+                    self.uplink_queue.put_nowait((time.monotonic(), handler, client, message.topic, message.payload))
+                except queue.Full:
+                    self.metrics.count("dropped")
+
+        return on_message
+
+    def uplink_worker(self):
+        while True:
+            received, handler, client, topic, payload = self.uplink_queue.get()
+
+            if time.monotonic() - received > self.config["max_message_age"]:
+                self.metrics.count("expired")
+                continue
+
+            try:
+                handler(self, client, topic, payload)
+            except Exception as e:
+                self.metrics.count("errors")
+                if self.debug:
+                    print(f"\nUplink error: {type(e).__name__}: {e}")
+            else:
+                self.metrics.handled_after(time.monotonic() - received)
+
+    def _flush_echo(self, context, reports):
+        client, topic = context
+        try:
+            _echo_rssi(self, client, topic, reports)
+        except Exception as e:
+            self.metrics.count("errors")
+            if self.debug:
+                print(f"\nUplink error: {type(e).__name__}: {e}")
+
+
+def _first_uplink(bridge, handler, topic, payload):
+    # returns the decoded uplink, or None if the telegram was already handled
+    # by this handler; the telegrams are deduplicated per handler, so
+    # subscriptions of different handlers on overlapping topics all get them
+    uplink = decode_uplink(payload)
+    endpoint = topic.split("/")[2]
+
+    first = uplink.cnt is None or bridge.deduplicator.first((handler, endpoint, uplink.cnt))
+
+    return _record_uplink(bridge, endpoint, uplink, first)
+
+
+def _record_uplink(bridge, endpoint, uplink, first):
+    # every base station report goes into the analytics once, the packet
+    # counter only with the first report of a telegram, whichever handler
+    # gets it first
+    if bridge.analytics:
+        if uplink.cnt is None:
+            bridge.analytics.record(endpoint, None, uplink.baseStations)
+        else:
+            reports = [
+                report
+                for report in uplink.baseStations
+                if bridge.deduplicator.first(("analytics", endpoint, uplink.cnt, report.bsEui))
+            ]
+            counted = bridge.deduplicator.first(("analytics", endpoint, uplink.cnt))
+            if reports or counted:
+                bridge.analytics.record(endpoint, uplink.cnt if counted else None, reports)
+
+    if not first:
+        bridge.metrics.count("duplicates")
+        return None
+
+    return uplink
+
+
+def handle_uplink(bridge, client, topic, payload):
+    uplink = decode_uplink(payload)
+    endpoint = topic.split("/")[2]
+
+    if bridge.coalescer.window > 0 and uplink.cnt is not None:
+        # the downlink is sent by the coalescer when the window is over
+        first = bridge.coalescer.add(("rssi_echo", endpoint, uplink.cnt), uplink.baseStations, (client, topic))
+        _record_uplink(bridge, endpoint, uplink, first)
+        return
+
+    first = uplink.cnt is None or bridge.deduplicator.first(("rssi_echo", endpoint, uplink.cnt))
+    if _record_uplink(bridge, endpoint, uplink, first):
+        _echo_rssi(bridge, client, topic, uplink.baseStations)
+
+
+def _echo_rssi(bridge, client, topic, basestations):
+    # the report of the base station with the best reception
+    basestation = max(basestations, key=lambda report: report.rssi)
+
+    rssi = basestation.rssi
+    eqSnr = basestation.eqSnr
+    snr = basestation.snr
+
+    data = (int(rssi), abs(int(round(rssi - int(rssi), 2) * 100)))
+
+    if bridge.debug:
+        print(f"\nReceived data:")
+        print("    rssi: ", end="")
+        print(rssi)
+        print("    eqSnr: ", end="")
+        print(eqSnr)
+        print("    snr: ", end="")
+        print(snr)
+        print("\n")
+
+        print(list(data))
+
+    client.publish(
+        "/".join(topic.split("/")[:3]) + "/downlink",
+        encode_downlink(data),
+    )
+
+
+def handle_analytics(bridge, client, topic, payload):
+    # only records the uplink in bridge.analytics, no downlink
+    _first_uplink(bridge, "link_analytics", topic, payload)
+
+
+def handle_decode(bridge, client, topic, payload):
+    # publishes the uplink data decoded with bridge.schema to .../decoded
+    uplink = _first_uplink(bridge, "decode_payload", topic, payload)
+    if uplink is None:
+        return
+
+    record = bridge.schema.decode(bytes(uplink.data or ()))
+
+    if bridge.debug:
+        print(f"\nDecoded data: {record}")
+
+    client.publish(
+        "/".join(topic.split("/")[:3]) + "/decoded",
+        json.dumps({"cnt": uplink.cnt, "record": record}),
+    )
+
+
+HANDLERS = {
+    "rssi_echo": handle_uplink,
+    "link_analytics": handle_analytics,
+    "decode_payload": handle_decode,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
 
-    client.subscribe(f"mioty/00-00-00-00-00-00-00-00/+/uplink")
+    parser.add_argument("--config", type=str, required=False, help="JSON config file, see mqtt_bridge.example.json")
 
-    client.loop_start()
+    console_args = parser.parse_args()
 
-    while True:
-        sleep(1)
+    MqttBridge(load_config(console_args.config)).run()
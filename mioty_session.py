@@ -0,0 +1,139 @@
+# /usr/bin/env
+
+# background session that owns the serial port, and a thin client that
+# forwards miotysensor commands to it over a Unix socket (POSIX only)
+#
+#   mioty_session serve [--port PORT] [--socket SOCKET] [--cache CACHE] [--capture CAPTURE]
+#   mioty_session [--socket SOCKET] {init,send,stream,discover,params} ...
+#
+# the client only imports the standard library, the port stays open and the
+# stack stays selected between commands; --port, --cache and --capture are
+# options of the session, a client request with them is rejected
+
+import json
+import os
+import socket
+import sys
+
+SOCKET_DEFAULT = "/tmp/miotysensor.sock"
+
+
+class _SocketWriter:
+    # file-like object that forwards console output to the client as it is
+    # written, so progress output shows up live
+    def __init__(self, connection, stream):
+        self.connection = connection
+        self.stream = stream
+
+    def write(self, text):
+        if text:
+            self.connection.sendall((json.dumps({self.stream: text}) + "\n").encode())
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def serve(port, socket_path, cache_path=None, capture_path=None):
+    from miotysensor import MiotySensor, BAUDRATE, build_parser, run_command
+    import contextlib
+    import io
+    import socketserver
+
+    capture = None
+    if capture_path:
+        from satp_capture import FrameCapture
+
+        capture = FrameCapture(capture_path)
+
+    sensor = MiotySensor(BAUDRATE, port, cache_path=cache_path, capture=capture)
+    parser = build_parser()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+
+            stdout = _SocketWriter(self.connection, "stdout")
+            stderr = _SocketWriter(self.connection, "stderr")
+            exit_code = 0
+
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    os.chdir(request["cwd"])
+                    console_args = parser.parse_args(request["argv"])
+                    for option in ("port", "cache", "capture"):
+                        if getattr(console_args, option):
+                            parser.error("--{} is set by mioty_session serve, not per command".format(option))
+                    run_command(sensor, console_args, io.StringIO(request.get("stdin", "")))
+                except SystemExit as e:
+                    exit_code = e.code if isinstance(e.code, int) else 1
+                except Exception as e:
+                    print("{}: {}".format(type(e).__name__, e), file=sys.stderr)
+                    exit_code = 1
+
+            self.wfile.write((json.dumps({"exit": exit_code}) + "\n").encode())
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    # one request at a time, the port is shared by all clients
+    with socketserver.UnixStreamServer(socket_path, Handler) as server:
+        print("SESSION: {} <-> {}".format(socket_path, port))
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+            sensor.close()
+
+
+def request(argv, socket_path=SOCKET_DEFAULT, stdin=None):
+    message = {"argv": argv, "cwd": os.getcwd()}
+    if stdin is not None:
+        message["stdin"] = stdin
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(message) + "\n").encode())
+
+        for line in connection.makefile("r", encoding="utf-8"):
+            response = json.loads(line)
+            if "stdout" in response:
+                sys.stdout.write(response["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in response:
+                sys.stderr.write(response["stderr"])
+            elif "exit" in response:
+                return response["exit"]
+
+    return 1
+
+
+def _option(argv, name, default):
+    # removes "--name value" from argv and returns value
+    if name in argv:
+        index = argv.index(name)
+        value = argv[index + 1]
+        del argv[index : index + 2]
+        return value
+    return default
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    socket_path = _option(argv, "--socket", os.environ.get("MIOTYSENSOR_SOCKET", SOCKET_DEFAULT))
+
+    if argv[:1] == ["serve"]:
+        from miotysensor import ComPort, PORT_DEFAULT
+        from mioty_discovery import resolve_port
+
+        serve(
+            resolve_port(ComPort(_option(argv, "--port", PORT_DEFAULT))),
+            socket_path,
+            _option(argv, "--cache", None),
+            _option(argv, "--capture", None),
+        )
+    else:
+        stdin = None
+        if argv[:1] == ["stream"] and "--file" not in argv:
+            stdin = sys.stdin.read()
+        sys.exit(request(argv, socket_path, stdin))
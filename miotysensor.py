@@ -1,10 +1,14 @@
 # /usr/bin/env
 
 from satp_serial import MiotySerialSATP as SSATP
-from satp_serial import int2hex4list
+from satp_serial import StackParamCache, int2hex4list
+from satp_metrics import prometheus_text
+from mioty_discovery import PROBE_TIMEOUT, discover, format_eui64, is_eui64, resolve_port
 import time
 import argparse
+import json
 import platform
+import sys
 
 BAUDRATE = 115200
 
@@ -13,26 +17,40 @@ if platform.system() == "Windows":
 else:
     PORT_DEFAULT = "/dev/ttyACM1"
 
+CACHE_DEFAULT = "miotysensor_cache.json"
+
 class MiotySensor:
-    def __init__(self, baudarte, port):
-        self.satp = SSATP(baudarte, port)
+    def __init__(self, baudarte, port, confirmation_timeout=SSATP.CONFIRMATION_TIMEOUT, verbose=True, cache_path=None, capture=None):
+        self.satp = SSATP(baudarte, port, confirmation_timeout, capture=capture)
+        # GET and SET of the stack parameters go through the cache
+        self.param_cache = StackParamCache(self.satp, cache_path)
         self.separator = "\n>   "
+        self.verbose = verbose
+        self.last_status = None
+        self.failures = 0
+        self.send_params = None
+
+    def close(self):
+        self.satp.close()
 
     def initialize(self, nwkkey):
-        print(self.separator, end="")
-        print("SATP_STACK_SELECT_STACK <- E_STACK_ID_MIOTY: ", end="")
-        self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SELECT_STACK, [SSATP.E_STACK_ID_MIOTY])
-        print(self.separator, end="")
-        print(
+        result = {}
+
+        self._print(self.separator, end="")
+        self._print("SATP_STACK_SELECT_STACK <- E_STACK_ID_MIOTY: ", end="")
+        self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SELECT_STACK, bytes((SSATP.E_STACK_ID_MIOTY,)))
+        self._print(self.separator, end="")
+        self._print(
             "SATP_STACK_SET <- E_STACK_PARAM_ID_MIOTY_NWKKEY <- {}: ".format(nwkkey),
             end="",
         )
-        self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SET, [SSATP.E_STACK_PARAM_ID_MIOTY_NWKKEY] + self.hex_string2list(nwkkey))
-        print(self.separator, end="")
-        print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_EUI64: ", end="")
-        eui = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, [SSATP.E_STACK_PARAM_ID_MIOTY_EUI64])
+        self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SET, bytes((SSATP.E_STACK_PARAM_ID_MIOTY_NWKKEY,)) + self.hex_string2bytes(nwkkey))
+        self._print(self.separator, end="")
+        self._print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_EUI64: ", end="")
+        eui = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, bytes((SSATP.E_STACK_PARAM_ID_MIOTY_EUI64,)))
         if eui:
-            print(
+            result["eui64"] = "-".join(int2hex4list(eui, without_0x=True))
+            self._print(
                 "      ⨽ EUI64: {}".format(
                     "-".join(
                         int2hex4list(
@@ -42,11 +60,12 @@ class MiotySensor:
                     )
                 )
             )
-        print(self.separator, end="")
-        print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_SHORT_ADDR: ", end="")
-        short_addr = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, [SSATP.E_STACK_PARAM_ID_MIOTY_SHORT_ADDR])
+        self._print(self.separator, end="")
+        self._print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_SHORT_ADDR: ", end="")
+        short_addr = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, bytes((SSATP.E_STACK_PARAM_ID_MIOTY_SHORT_ADDR,)))
         if short_addr:
-            print(
+            result["short_addr"] = "".join(int2hex4list(short_addr, without_0x=True))
+            self._print(
                 "      ⨽ SHORT_ADDR: {}".format(
                     "".join(
                         int2hex4list(
@@ -57,68 +76,84 @@ class MiotySensor:
                 )
             )
 
+        return result
+
+    def read_eui64(self):
+        self._print(self.separator, end="")
+        self._print("SATP_STACK_SELECT_STACK <- E_STACK_ID_MIOTY: ", end="")
+        self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SELECT_STACK, bytes((SSATP.E_STACK_ID_MIOTY,)))
+        self._print(self.separator, end="")
+        self._print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_EUI64: ", end="")
+        eui = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, bytes((SSATP.E_STACK_PARAM_ID_MIOTY_EUI64,)))
+        if eui:
+            return "-".join(int2hex4list(eui, without_0x=True))
+
     def send_data(self, data, timeout, period, save_data):
+        received_data = None
+
         if type(data) == bool:
             data = None
-            print("READING FROM FILE: ", end="")
+            self._print("READING FROM FILE: ", end="")
             try:
                 with open("data", "r") as data_file:
                     data = data_file.readline()
                     if data[len(data) - 1] == "\n":
                         data = data[:-1]
                     if data:
-                        print("OK")
+                        self._print("OK")
                     else:
-                        print("DATA NOT FOUND")
+                        self._print("DATA NOT FOUND")
             except Exception as e:
-                print(type(e).__name__)
+                self._print(type(e).__name__)
 
         if data:
-            print(self.separator, end="")
-            print(
-                "SATP_STACK_SEND_PARAMS <- E_STACK_SEND_PARAM_ID_MIOTY_RX_WINDOW <- 0x01: ",
-                end="",
-            )
-            self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SEND_PARAMS, [SSATP.E_STACK_SEND_PARAM_ID_MIOTY_RX_WINDOW, 0x01])
-            
-            print(self.separator, end="")
-            print(
+            self.set_send_params(bytes((SSATP.E_STACK_SEND_PARAM_ID_MIOTY_RX_WINDOW, 0x01)))
+
+            self._print(self.separator, end="")
+            self._print(
                 "SATP_STACK_NB_SEND <- {}: ".format(data),
                 end="",
             )
-            self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_NB_SEND, self.hex_string2list(data))
+            since = self._drain_indications()
+            self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_NB_SEND, self.hex_string2bytes(data))
+            since = max(since, self.satp.confirmation_received or since)
             
             if timeout>0:
-                print(self.separator, end="")
-                print(
+                self._print(self.separator, end="")
+                self._print(
                     "WAITING_FOR_INDICATION: ",
                     end="\r",
                 )
 
-            
-                chek_times = int(timeout / period)
-                indication = False
-                for t in range(chek_times):
-                    time.sleep(period)
-                    if self.satp.check_serial():
-                        readed_data = self.satp.read_data()
-                        for dat in readed_data:
-                            if dat[3] and dat[3][0] == SSATP.E_STACK_EVENT_RX_SUCCESS:
-                                indication = True
-                                break
-                        if indication: break
-                    else:
-                        print(
-                            f"\r>   WAITING FOR INDICATION: [{"▮" * (t + 1)}{"-" * (chek_times - 1 - t)}] {period*t}s  ",
-                            end="",
-                        )
+
+                # the wait returns as soon as the indication is received,
+                # period only sets how often the progress bar is redrawn
+                chek_times = max(int(timeout / period), 1)
+                start = time.monotonic()
+                indication = None
+                while True:
+                    elapsed = time.monotonic() - start
+                    if elapsed >= timeout:
+                        break
+                    t = min(int(elapsed / period), chek_times - 1)
+                    self._print(
+                        f"\r>   WAITING FOR INDICATION: [{'▮' * (t + 1)}{'-' * (chek_times - 1 - t)}] {period*t:g}s  ",
+                        end="",
+                    )
+                    indication = self.satp.wait_for_indication(
+                        (SSATP.E_STACK_EVENT_RX_SUCCESS,),
+                        min(period, timeout - elapsed),
+                        since,
+                    )
+                    if indication:
+                        break
                 if indication:
-                    print()
-                    print(self.separator, end="")
-                    print("SATP_STACK_RECEIVE: ", end="")
+                    self._print()
+                    self._print(self.separator, end="")
+                    self._print("SATP_STACK_RECEIVE: ", end="")
                     received_data = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_RECEIVE)
                     if received_data:
-                        print(
+                        self._print(
                             "      ⨽ DATA: {}".format(
                                 ", ".join(
                                     int2hex4list(received_data)
@@ -128,90 +163,179 @@ class MiotySensor:
                         if save_data:
                             with open("data", "w") as data_file:
                                 data_file.write("".join(int2hex4list(received_data, without_0x=True)))
-                                print(
+                                self._print(
                                     "          ⨽ WRITING TO FILE: OK"
                                 )
                 else:
-                    print(f"\r>   WAITING FOR INDICATION: TIMEOUT      " + " "*chek_times)
+                    self._print(f"\r>   WAITING FOR INDICATION: TIMEOUT      " + " "*chek_times)
 
-    def get_set_params(self, tx_power, mioty_mode, mioty_profile):
-        if tx_power != None:
-            if type(tx_power) == bool:
-                print(self.separator, end="")
-                print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_TX_POWER: ", end="")
-                u_tx_power_value = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, [SSATP.E_STACK_PARAM_ID_MIOTY_TX_POWER])[0]
-                if u_tx_power_value:
-                    if u_tx_power_value>127:
-                        s_tx_power_value = u_tx_power_value-256
-                    else:
-                        s_tx_power_value = u_tx_power_value
-                    print(
-                        "      ⨽ TX_POWER: {} ({})".format(
-                            s_tx_power_value, hex(u_tx_power_value)
-                        )
-                    )
+        return received_data
+
+    def send_stream(self, payloads, rx_window=True, tx_timeout=30):
+        # sends every payload (hex string) as soon as the previous one is
+        # reported as transmitted (E_STACK_EVENT_TX_SUCCESS)
+        self.set_send_params(bytes((SSATP.E_STACK_SEND_PARAM_ID_MIOTY_RX_WINDOW, 0x01 if rx_window else 0x00)))
+
+        latencies = []
+        failed = 0
+
+        start = time.monotonic()
+        for data in payloads:
+            data = data.strip()
+            if not data:
+                continue
+
+            sent = time.monotonic()
+            self._print(self.separator, end="")
+            self._print("SATP_STACK_NB_SEND <- {}: ".format(data), end="")
+            try:
+                payload = self.hex_string2bytes(data)
+            except ValueError:
+                # a line that is not a hex string is skipped, not the stream
+                self._print("INVALID", end="")
+                failed += 1
+                continue
+
+            self._drain_indications()
+            confirmation = self.satp.send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_NB_SEND, payload)
+            if confirmation is None or confirmation[2] != 0:
+                self._print("ERROR" if confirmation else "TIMEOUT", end="")
+                failed += 1
+                continue
+
+            if self.satp.wait_for_indication((SSATP.E_STACK_EVENT_TX_SUCCESS,), tx_timeout, self.satp.confirmation_received):
+                latency = time.monotonic() - sent
+                latencies.append(latency)
+                self._print("TX_SUCCESS {:.3f}s".format(latency), end="")
             else:
-                print(self.separator, end="")
-                print(
-                    "SATP_STACK_SET <- E_STACK_PARAM_ID_MIOTY_TX_POWER <- {}: ".format(
-                        hex(tx_power)
-                    ),
-                    end="",
-                )
-                self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SET, [SSATP.E_STACK_PARAM_ID_MIOTY_TX_POWER, tx_power])
-
-        if mioty_mode != None:
-            if type(mioty_mode) == bool:
-                print(self.separator, end="")
-                print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_MODE: ", end="")
-                mioty_mode_value = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, [SSATP.E_STACK_PARAM_ID_MIOTY_MODE])
-                if mioty_mode_value:
-                    print(
-                        "      ⨽ MIOTY_MODE: {} ({})".format(
-                            mioty_mode_value[0], hex(mioty_mode_value[0])
-                        )
-                    )
+                self._print("TX TIMEOUT", end="")
+                failed += 1
+        elapsed = time.monotonic() - start
+
+        result = {
+            "sent": len(latencies),
+            "failed": failed,
+            "elapsed": elapsed,
+            "rate": len(latencies) / elapsed if elapsed > 0 else 0,
+        }
+        if latencies:
+            result["latency_min"] = min(latencies)
+            result["latency_mean"] = sum(latencies) / len(latencies)
+            result["latency_max"] = max(latencies)
+
+        self._print()
+        self._print(self.separator, end="")
+        self._print(
+            "SENT: {sent}, FAILED: {failed}, {rate:.2f} msg/s".format(**result)
+        )
+        if latencies:
+            self._print(
+                "      ⨽ LATENCY: min {latency_min:.3f}s, mean {latency_mean:.3f}s, max {latency_max:.3f}s".format(**result)
+            )
+
+        return result
+
+    def get_set_params(self, tx_power, mioty_mode, mioty_profile):
+        # True reads the parameter, a value writes it, None skips it; all
+        # parameters are transferred in one batch
+        params = []
+        for name, param_id, value in (
+            ("tx_power", SSATP.E_STACK_PARAM_ID_MIOTY_TX_POWER, tx_power),
+            ("mioty_mode", SSATP.E_STACK_PARAM_ID_MIOTY_MODE, mioty_mode),
+            ("mioty_profile", SSATP.E_STACK_PARAM_ID_MIOTY_PROFILE, mioty_profile),
+        ):
+            if value != None:
+                params.append((name, param_id, None if type(value) == bool else value))
+
+        confirmations = self.param_cache.transfer(
+            [(param_id, None if value is None else bytes((value,))) for _, param_id, value in params]
+        )
+
+        result = {}
+
+        for name, param_id, value in params:
+            self._print(self.separator, end="")
+            if value is None:
+                self._print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_{}: ".format(name.upper().replace("MIOTY_", "")), end="")
             else:
-                print(self.separator, end="")
-                print(
-                    "SATP_STACK_SET <- E_STACK_PARAM_ID_MIOTY_MODE <- {}: ".format(
-                        hex(mioty_mode)
-                    ),
+                self._print(
+                    "SATP_STACK_SET <- E_STACK_PARAM_ID_MIOTY_{} <- {}: ".format(name.upper().replace("MIOTY_", ""), hex(value)),
                     end="",
                 )
-                self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SET, [SSATP.E_STACK_PARAM_ID_MIOTY_MODE, mioty_mode])
-
-        if mioty_profile != None:
-            if type(mioty_profile) == bool:
-                print(self.separator, end="")
-                print("SATP_STACK_GET <- E_STACK_PARAM_ID_MIOTY_PROFILE: ", end="")
-                mioty_profile_value = self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, [SSATP.E_STACK_PARAM_ID_MIOTY_PROFILE])
-                if mioty_profile_value:
-                    print(
-                        "      ⨽ MIOTY_PROFILE: {} ({})".format(
-                            mioty_profile_value[0], hex(mioty_profile_value[0])
-                        )
-                    )
+
+            data = self._confirmation_status(confirmations[param_id])
+            if value is None and data:
+                value = data[0]
+                if name == "tx_power":
+                    self._print("      ⨽ {}: {} ({})".format(name.upper(), value - 256 if value > 127 else value, hex(value)))
+                else:
+                    self._print("      ⨽ {}: {} ({})".format(name.upper(), value, hex(value)))
+            elif value is None or self.last_status != "OK":
+                continue
+
+            if name == "tx_power":
+                result[name] = value - 256 if value > 127 else value
             else:
-                print(self.separator, end="")
-                print(
-                    "SATP_STACK_SET <- E_STACK_PARAM_ID_MIOTY_PROFILE <- {}: ".format(
-                        hex(mioty_profile)
-                    ),
-                    end="",
-                )
-                self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SET, [SSATP.E_STACK_PARAM_ID_MIOTY_PROFILE, mioty_profile])
-
-    def _send_with_confirmation(self, api_id, comand_id, parameter = []):
-        self.satp.send_data(api_id, comand_id, parameter)
-        time.sleep(0.5)
-        payload = self.satp.read_data()
-        if payload[0][2] == 0:
-            print("OK")
-            return payload[0][3]
+                result[name] = value
+
+        return result
+
+    def set_send_params(self, send_params):
+        # the module keeps the send params, they are only sent again when
+        # they change
+        if send_params == self.send_params:
+            return
+
+        self._print(self.separator, end="")
+        self._print(
+            "SATP_STACK_SEND_PARAMS <- {}: ".format(", ".join(int2hex4list(send_params))),
+            end="",
+        )
+        self._send_with_confirmation(SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_SEND_PARAMS, send_params)
+        if self.last_status == "OK":
+            self.send_params = send_params
+
+    def _drain_indications(self):
+        # indications of earlier telegrams, queued or still unread in the
+        # port, must not end the wait for the next one; returns the time
+        # from which indications belong to the next telegram
+        self.satp.read_data()
+        return time.monotonic()
+
+    def _send_with_confirmation(self, api_id, comand_id, parameter = b""):
+        if api_id == SSATP.API_SATP_STACK_CMD and comand_id == SSATP.SATP_STACK_GET:
+            confirmation = self.param_cache.get(parameter[0])
+        elif api_id == SSATP.API_SATP_STACK_CMD and comand_id == SSATP.SATP_STACK_SET:
+            confirmation = self.param_cache.set(parameter[0], parameter[1:])
+        else:
+            confirmation = self.satp.send_with_confirmation(api_id, comand_id, parameter)
+
+        return self._confirmation_status(confirmation)
+
+    def _confirmation_status(self, confirmation):
+        if confirmation is None:
+            self.last_status = "TIMEOUT"
+            self.failures += 1
+            self._print("TIMEOUT")
+        elif confirmation[2] == 0:
+            self.last_status = "OK"
+            self._print("OK")
+            return confirmation[3]
         else:
-            print("ERROR")
-            print("      ⨽ ERROR_CODE = {}".format(payload[0][3][0]))
+            self.last_status = "ERROR"
+            self.failures += 1
+            self._print("ERROR")
+            if confirmation[3]:
+                self._print("      ⨽ ERROR_CODE = {}".format(confirmation[3][0]))
+
+    def _print(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
+
+    def hex_string2bytes(self, string):
+        string = string.replace("-", "")
+
+        return bytes.fromhex(string[: len(string) // 2 * 2])
 
     def hex_string2list(self, string):
         string = string.replace("-", "")
@@ -270,6 +394,9 @@ def MiotyMode(value):
         raise argparse.ArgumentTypeError("mode index must be in range [0, 2]")
 
 def ComPort(value):
+    # an EUI64 is resolved to the port of the module with resolve_port()
+    if is_eui64(value):
+        return format_eui64(value)
     if value[:5] == "/dev/":
         return value
     value = value.upper()
@@ -280,7 +407,7 @@ def ComPort(value):
         return "COM"+str(value)
     raise argparse.ArgumentTypeError("invalid port name")
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -288,6 +415,34 @@ if __name__ == "__main__":
         type=ComPort,
         required=False
     )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        type=str,
+        required=False,
+        const=CACHE_DEFAULT,
+        help="keep the stack parameters in a JSON file, default: {}".format(CACHE_DEFAULT),
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="?",
+        choices=["json", "prometheus"],
+        required=False,
+        const="json",
+        help="print the link metrics after the command",
+    )
+    parser.add_argument(
+        "--schema",
+        type=str,
+        required=False,
+        help="payload schema (see payload_codec.py), send --data and stream then take JSON records",
+    )
+    parser.add_argument(
+        "--capture",
+        type=str,
+        required=False,
+        help="record the raw serial traffic to a capture file, see satp_capture.py",
+    )
 
     subparses = parser.add_subparsers(dest="function", required=True)
 
@@ -328,6 +483,18 @@ if __name__ == "__main__":
         action="store_true",
     )
     
+    parser_stream = subparses.add_parser("stream")
+    parser_stream.add_argument("--file", type=str, required=False, help="one hex payload per line, default: stdin")
+    parser_stream.add_argument("-t", "--tx_timeout", type=float, required=False, default=30,)
+    parser_stream.add_argument("--no_rx_window",
+        required=False,
+        action="store_true",
+    )
+
+    parser_discover = subparses.add_parser("discover")
+    parser_discover.add_argument("--ports", nargs="+", required=False, help="port names or glob patterns, default: all serial ports")
+    parser_discover.add_argument("-t", "--timeout", type=float, required=False, default=PROBE_TIMEOUT,)
+
     parser_params = subparses.add_parser("params")
 
     parser_params.add_argument(
@@ -352,15 +519,56 @@ if __name__ == "__main__":
         const=True,
     )
 
-    console_args = parser.parse_args()
+    return parser
 
-    if console_args.port:
-        PORT = console_args.port
-    else: PORT = PORT_DEFAULT
 
-    #print(console_args)
+def _encode_lines(lines, schema):
+    # with a schema every line is a JSON record, otherwise a hex payload
+    # a record that can not be encoded is passed on as it is and counted as
+    # invalid by send_stream()
+    for line in lines:
+        if schema and line.strip():
+            try:
+                yield schema.encode(json.loads(line)).hex()
+            except (ValueError, KeyError, TypeError):
+                yield line
+        else:
+            yield line
 
-    sensor = MiotySensor(BAUDRATE, PORT)
+
+def run_discover(console_args, exclude=()):
+    # exclude: ports that are already open, e.g. by mioty_session
+    ports = None
+    if console_args.ports:
+        import glob
+
+        ports = []
+        for pattern in console_args.ports:
+            ports += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+
+    found = discover(ports, BAUDRATE, console_args.timeout, exclude)
+
+    print("DISCOVERED: {}".format(len(found)))
+    for port, eui64 in found.items():
+        print("      ⨽ {}: {}".format(port, eui64))
+
+    return found
+
+
+def print_metrics(sensor, output_format):
+    snapshot = sensor.satp.metrics.snapshot()
+    if output_format == "prometheus":
+        print(prometheus_text(snapshot, {"port": sensor.satp.serial.port}), end="")
+    else:
+        print(json.dumps(snapshot, indent=4))
+
+
+def run_command(sensor, console_args, stdin=sys.stdin):
+    schema = None
+    if console_args.schema:
+        from payload_codec import load_schema
+
+        schema = load_schema(console_args.schema)
 
     if console_args.function == "init":
         sensor.initialize(console_args.networkKey)
@@ -370,10 +578,56 @@ if __name__ == "__main__":
             console_args.miotyProfile,
         )
     elif console_args.function == "send":
-        sensor.send_data(console_args.data, console_args.timeout, console_args.period, console_args.save_data)
+        data = console_args.data
+        if schema and type(data) != bool:
+            data = schema.encode(json.loads(data)).hex()
+        sensor.send_data(data, console_args.timeout, console_args.period, console_args.save_data)
+    elif console_args.function == "stream":
+        if console_args.file:
+            with open(console_args.file, "r") as payload_file:
+                sensor.send_stream(_encode_lines(payload_file, schema), not console_args.no_rx_window, console_args.tx_timeout)
+        else:
+            sensor.send_stream(_encode_lines(stdin, schema), not console_args.no_rx_window, console_args.tx_timeout)
+    elif console_args.function == "discover":
+        run_discover(console_args, [sensor.satp.serial.port] if sensor else [])
+        return
     elif console_args.function == "params":
         sensor.get_set_params(
             console_args.txPower,
             console_args.miotyMode,
             console_args.miotyProfile,
         )
+
+    if console_args.metrics:
+        print_metrics(sensor, console_args.metrics)
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    console_args = parser.parse_args()
+
+    if console_args.function == "discover":
+        run_command(None, console_args)
+        sys.exit()
+
+    if console_args.port:
+        try:
+            PORT = resolve_port(console_args.port, BAUDRATE)
+        except LookupError as e:
+            parser.error(str(e))
+    else: PORT = PORT_DEFAULT
+
+    #print(console_args)
+
+    capture = None
+    if console_args.capture:
+        from satp_capture import FrameCapture
+
+        capture = FrameCapture(console_args.capture)
+
+    sensor = MiotySensor(BAUDRATE, PORT, cache_path=console_args.cache, capture=capture)
+
+    try:
+        run_command(sensor, console_args)
+    finally:
+        sensor.close()
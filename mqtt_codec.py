@@ -0,0 +1,81 @@
+# /usr/bin/env
+
+# JSON codec for the mioty MQTT messages
+#
+# decode_uplink() reads only the packet counter, the payload (data) and the
+# base station reports (rssi, snr, eqSnr, bsEui) of an uplink message, with
+# msgspec (typed decoding, all other fields are skipped) or orjson if one of
+# them is installed, otherwise with the json module of the standard library;
+# encode_downlink() builds the downlink message from a cached pre-serialised
+# template
+#
+#   pip install msgspec     or     pip install orjson
+
+from collections import namedtuple
+from functools import lru_cache
+import json
+
+BaseStation = namedtuple("BaseStation", ["rssi", "snr", "eqSnr", "bsEui"], defaults=(None,))
+Uplink = namedtuple("Uplink", ["cnt", "baseStations", "data"], defaults=(None,))
+
+DOWNLINK_CACHE_SIZE = 4096
+
+try:
+    import msgspec
+
+    class _BaseStation(msgspec.Struct):
+        rssi: float
+        snr: float
+        eqSnr: float
+        bsEui: str | int | None = None
+
+    class _Uplink(msgspec.Struct):
+        baseStations: list[_BaseStation]
+        cnt: int | None = None
+        data: list[int] | None = None
+
+    _uplink_decoder = msgspec.json.Decoder(_Uplink)
+
+    CODEC = "msgspec"
+
+    def decode_uplink(payload):
+        return _uplink_decoder.decode(payload)
+
+except ImportError:
+    try:
+        import orjson
+
+        _loads = orjson.loads
+        CODEC = "orjson"
+    except ImportError:
+        _loads = json.loads
+        CODEC = "json"
+
+    def decode_uplink(payload):
+        return _uplink_from_dict(_loads(payload))
+
+
+def decode_uplink_json(payload):
+    # reference implementation with the standard library only
+    return _uplink_from_dict(json.loads(payload))
+
+
+def _uplink_from_dict(message):
+    return Uplink(
+        message.get("cnt"),
+        [
+            BaseStation(basestation["rssi"], basestation["snr"], basestation["eqSnr"], basestation.get("bsEui"))
+            for basestation in message["baseStations"]
+        ],
+        message.get("data"),
+    )
+
+
+_DOWNLINK_TEMPLATE = '{{"data": [{}], "format": 0, "presched": true}}'
+
+
+@lru_cache(maxsize=DOWNLINK_CACHE_SIZE)
+def encode_downlink(data):
+    # data is a tuple of byte values, the downlinks sent by the script depend
+    # only on the RSSI, so the same messages repeat and come from the cache
+    return _DOWNLINK_TEMPLATE.format(", ".join(str(value) for value in data)).encode()
@@ -0,0 +1,204 @@
+# /usr/bin/env
+
+# schema driven binary codec for the telegram payloads
+#
+# a schema is a list of fields, packed MSB first into a bit stream without
+# padding between the fields (the last byte is padded with zeros):
+#
+#   {"name": "temperature", "type": "int", "bits": 11, "scale": 0.1, "offset": 0}
+#
+# - uint, int  bits wide (int in two's complement), the value is stored as
+#              round((value - offset) / scale); scale and offset default to
+#              1 and 0
+# - bool       1 bit
+# - float      32 bit IEEE 754
+# - varint     7 bits per group with a continuation bit, signed values
+#              zigzag encoded (signed, default true), scale and offset as above
+# - series     list of values, count values or a varint length first; with
+#              delta only the first value is stored like a uint/int (or a
+#              varint without bits), the others as zigzag varint differences
+#              to their predecessor
+#
+#   schema = load_schema("payload_schema.example.json")
+#   data = schema.encode({"temperature": 21.5, ...})   # bytes for NB_SEND
+#   record = schema.decode(data)
+
+import json
+import struct
+
+FIELD_TYPES = ("uint", "int", "bool", "float", "varint", "series")
+
+_FLOAT = struct.Struct(">f")
+
+
+class _BitWriter:
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        self.value = (self.value << bits) | (value & ((1 << bits) - 1))
+        self.bits += bits
+
+    def write_varint(self, value):
+        while True:
+            group = value & 0x7F
+            value >>= 7
+            if not value:
+                self.write(group, 8)
+                return
+            self.write(group | 0x80, 8)
+
+    def getvalue(self):
+        padding = -self.bits % 8
+        return (self.value << padding).to_bytes((self.bits + padding) // 8, "big")
+
+
+class _BitReader:
+    def __init__(self, data):
+        self.value = int.from_bytes(data, "big")
+        self.remaining = len(data) * 8
+
+    def read(self, bits):
+        if bits > self.remaining:
+            raise ValueError("payload too short")
+        self.remaining -= bits
+        return (self.value >> self.remaining) & ((1 << bits) - 1)
+
+    def read_varint(self):
+        value = 0
+        shift = 0
+        while True:
+            group = self.read(8)
+            value |= (group & 0x7F) << shift
+            if not group & 0x80:
+                return value
+            shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+class Schema:
+    def __init__(self, fields):
+        for field in fields:
+            if field.get("type") not in FIELD_TYPES:
+                raise ValueError("{}: unknown type {}".format(field.get("name"), field.get("type")))
+            if field["type"] in ("uint", "int") and not field.get("bits"):
+                raise ValueError("{}: bits missing".format(field["name"]))
+        self.fields = fields
+
+    def encode(self, record):
+        writer = _BitWriter()
+
+        for field in self.fields:
+            value = record[field["name"]]
+            kind = field["type"]
+
+            if kind == "series":
+                values = [self._quantize(field, element) for element in value]
+                if field.get("count") is None:
+                    writer.write_varint(len(values))
+                elif len(values) != field["count"]:
+                    raise ValueError("{}: {} values expected".format(field["name"], field["count"]))
+
+                previous = None
+                for raw in values:
+                    if previous is not None and field.get("delta"):
+                        writer.write_varint(_zigzag(raw - previous))
+                    else:
+                        self._write_raw(writer, field, raw)
+                    previous = raw
+            elif kind == "bool":
+                writer.write(1 if value else 0, 1)
+            elif kind == "float":
+                writer.write(int.from_bytes(_FLOAT.pack(value), "big"), 32)
+            else:
+                self._write_raw(writer, field, self._quantize(field, value))
+
+        return writer.getvalue()
+
+    def decode(self, data):
+        reader = _BitReader(data)
+        record = {}
+
+        for field in self.fields:
+            kind = field["type"]
+
+            if kind == "series":
+                count = field.get("count")
+                if count is None:
+                    count = reader.read_varint()
+
+                values = []
+                previous = None
+                for _ in range(count):
+                    if previous is not None and field.get("delta"):
+                        raw = previous + _unzigzag(reader.read_varint())
+                    else:
+                        raw = self._read_raw(reader, field)
+                    values.append(self._scale(field, raw))
+                    previous = raw
+                record[field["name"]] = values
+            elif kind == "bool":
+                record[field["name"]] = bool(reader.read(1))
+            elif kind == "float":
+                record[field["name"]] = _FLOAT.unpack(reader.read(32).to_bytes(4, "big"))[0]
+            else:
+                record[field["name"]] = self._scale(field, self._read_raw(reader, field))
+
+        return record
+
+    def _quantize(self, field, value):
+        return int(round((value - field.get("offset", 0)) / field.get("scale", 1)))
+
+    def _scale(self, field, raw):
+        scale = field.get("scale", 1)
+        offset = field.get("offset", 0)
+        if scale == 1 and offset == 0:
+            return raw
+        # cuts off the float error of the multiplication
+        return round(raw * scale + offset, 9)
+
+    def _write_raw(self, writer, field, raw):
+        bits = field.get("bits")
+        signed = field["type"] == "int" or (field["type"] != "uint" and field.get("signed", True))
+
+        if not bits:
+            if not signed and raw < 0:
+                raise ValueError("{}: {} out of range".format(field["name"], self._scale(field, raw)))
+            writer.write_varint(_zigzag(raw) if signed else raw)
+            return
+
+        if signed:
+            low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+        else:
+            low, high = 0, (1 << bits) - 1
+        if not low <= raw <= high:
+            raise ValueError("{}: {} out of range".format(field["name"], self._scale(field, raw)))
+
+        writer.write(raw, bits)
+
+    def _read_raw(self, reader, field):
+        bits = field.get("bits")
+        signed = field["type"] == "int" or (field["type"] != "uint" and field.get("signed", True))
+
+        if not bits:
+            raw = reader.read_varint()
+            return _unzigzag(raw) if signed else raw
+
+        raw = reader.read(bits)
+        if signed and raw >= 1 << (bits - 1):
+            raw -= 1 << bits
+        return raw
+
+
+def load_schema(path):
+    # JSON file {"fields": [...]}
+    with open(path, "r") as schema_file:
+        return Schema(json.load(schema_file)["fields"])
@@ -0,0 +1,149 @@
+# /usr/bin/env
+
+import asyncio
+import serial
+
+from satp_serial import MiotySerialSATP as SSATP
+from satp_serial import SATPDecoder, SATPEncoder
+
+
+class SATPProtocol(asyncio.Protocol):
+    def __init__(self):
+        self.decoder = SATPDecoder()
+        self.transport = None
+
+        self.confirmations = asyncio.Queue()
+        self.indications = asyncio.Queue(maxsize=SSATP.INDICATION_QUEUE_SIZE)
+        self.on_indication = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        for message in self.decoder.feed(data):
+            if message[1] == SSATP.API_SATP_STACK_IND:
+                if self.on_indication:
+                    self.on_indication(message)
+                else:
+                    self._queue_indication(message)
+            else:
+                self.confirmations.put_nowait(message)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        # wakes up the indication iterator
+        self._queue_indication(None)
+
+    def _queue_indication(self, message):
+        if self.indications.full():
+            self.indications.get_nowait()
+        self.indications.put_nowait(message)
+
+
+class AsyncMiotySerialSATP:
+    # asyncio variant of MiotySerialSATP, the serial port is opened with
+    # pyserial (so the line settings are the same) and its file descriptor is
+    # then handed to the event loop as a read and a write pipe
+    #
+    # only supported by the selector event loop on POSIX systems
+
+    def __init__(self, baudrate, port, confirmation_timeout=SSATP.CONFIRMATION_TIMEOUT):
+        self.serial = serial.Serial()
+
+        self.serial.baudrate = baudrate
+        self.serial.port = port
+        self.serial.timeout = 0
+        self.serial.exclusive = True
+
+        self.confirmation_timeout = confirmation_timeout
+
+        self.encoder = SATPEncoder()
+
+        self.protocol = None
+        self._write_transport = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+
+        self.serial.open()
+
+        fd = self.serial.fileno()
+
+        self.protocol = SATPProtocol()
+        await loop.connect_read_pipe(
+            lambda: self.protocol,
+            open(fd, "rb", buffering=0, closefd=False),
+        )
+        self._write_transport, _ = await loop.connect_write_pipe(
+            asyncio.BaseProtocol,
+            open(fd, "wb", buffering=0, closefd=False),
+        )
+
+        return self
+
+    def close(self):
+        if self._write_transport:
+            self._write_transport.close()
+            self._write_transport = None
+        if self.protocol and self.protocol.transport:
+            self.protocol.transport.close()
+        self.serial.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def on_indication(self):
+        return self.protocol.on_indication
+
+    @on_indication.setter
+    def on_indication(self, callback):
+        self.protocol.on_indication = callback
+
+    def send_data(self, api_id, command_id, parameter=b""):
+        # the transport copies what it cannot write immediately, so the
+        # encoder buffer can be reused right away
+        self._write_transport.write(self.encoder.pack(api_id, command_id, parameter))
+
+    async def send_with_confirmation(self, api_id, command_id, parameter=b"", timeout=None):
+        confirmations = self.protocol.confirmations
+        while not confirmations.empty():
+            confirmations.get_nowait()
+
+        self.send_data(api_id, command_id, parameter)
+
+        return await self.wait_for_confirmation(timeout)
+
+    async def wait_for_confirmation(self, timeout=None):
+        if timeout is None:
+            timeout = self.confirmation_timeout
+
+        try:
+            return await asyncio.wait_for(self.protocol.confirmations.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def indications(self):
+        while True:
+            message = await self.protocol.indications.get()
+            if message is None:
+                return
+            yield message
+
+
+if __name__ == "__main__":
+
+    async def main():
+        async with AsyncMiotySerialSATP(115200, "/dev/ttyACM1") as satp:
+            print(
+                await satp.send_with_confirmation(
+                    SSATP.API_SATP_STACK_CMD,
+                    SSATP.SATP_STACK_GET,
+                    [SSATP.E_STACK_PARAM_ID_MIOTY_EUI64],
+                )
+            )
+
+    asyncio.run(main())
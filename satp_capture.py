@@ -0,0 +1,227 @@
+# /usr/bin/env
+
+# binary capture of the raw SATP traffic of a port and replay tool
+#
+#   satp = MiotySerialSATP(115200, port, capture=FrameCapture("modem.cap"))
+#   miotysensor --capture modem.cap ...
+#
+#   satp_capture [--speed SPEED] [--pty] [--verbose] FILE
+#
+# every written frame (TX) and every chunk read from the port (RX, as read,
+# so corrupted data is kept) is appended as a record to a preallocated,
+# memory-mapped file; when it is full it is renamed to FILE.1 (FILE.1 to
+# FILE.2, ...) and a new one is started, at most files files are kept; a
+# capture left by an earlier run is rotated the same way, every run starts
+# with a START record
+#
+# file:    MAGIC, end of the last record (uint64)
+# record:  time.monotonic() (double), direction (uint8), length (uint16), data
+
+from satp_serial import SATPDecoder
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"SATPCAP1"
+FILE_HEADER = struct.Struct("<8sQ")
+RECORD_HEADER = struct.Struct("<dBH")
+
+TX = 0
+RX = 1
+START = 2
+
+DIRECTION_NAMES = {TX: "TX", RX: "RX", START: "START"}
+
+CAPTURE_SIZE = 4 * 1024 * 1024
+CAPTURE_FILES = 4
+
+
+class FrameCapture:
+    def __init__(self, path, size=CAPTURE_SIZE, files=CAPTURE_FILES):
+        self.path = path
+        self.size = size
+        self.files = files
+
+        self.lock = threading.Lock()
+        self.file = None
+        self.map = None
+        self.pos = 0
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._shift()
+        self._open()
+        self._append(START, b"")
+
+    def tx(self, data):
+        self._append(TX, data)
+
+    def rx(self, data):
+        self._append(RX, data)
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _append(self, direction, data):
+        length = len(data)
+        if length > 0xFFFF:
+            for pos in range(0, length, 0xFFFF):
+                self._append(direction, data[pos : pos + 0xFFFF])
+            return
+
+        with self.lock:
+            if self.map is None:
+                return
+            end = self.pos + RECORD_HEADER.size + length
+            if end > self.size:
+                self._rotate()
+                end = self.pos + RECORD_HEADER.size + length
+
+            RECORD_HEADER.pack_into(self.map, self.pos, time.monotonic(), direction, length)
+            self.map[self.pos + RECORD_HEADER.size : end] = data
+            self.pos = end
+            FILE_HEADER.pack_into(self.map, 0, MAGIC, end)
+
+    def _open(self):
+        self.file = open(self.path, "w+b")
+        self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.pos = FILE_HEADER.size
+        FILE_HEADER.pack_into(self.map, 0, MAGIC, self.pos)
+
+    def _close(self):
+        if self.map is None:
+            return
+        self.map.close()
+        self.map = None
+        # the unused rest of the preallocated file is cut off
+        self.file.truncate(self.pos)
+        self.file.close()
+
+    def _rotate(self):
+        self._close()
+        self._shift()
+        self._open()
+
+    def _shift(self):
+        for index in range(self.files - 1, 0, -1):
+            source = self.path if index == 1 else "{}.{}".format(self.path, index - 1)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.path, index))
+
+
+def read_capture(path):
+    # yields (timestamp, direction, data) of one capture file
+    with open(path, "rb") as capture_file:
+        data = capture_file.read()
+
+    magic, end = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("{} is not a capture file".format(path))
+
+    pos = FILE_HEADER.size
+    while pos < end:
+        timestamp, direction, length = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        yield timestamp, direction, data[pos : pos + length]
+        pos += length
+
+
+def read_captures(path, files=CAPTURE_FILES):
+    # yields the records of the rotated files and of path, oldest first; the
+    # records of several runs are separated by their START records
+    for index in range(files - 1, 0, -1):
+        rotated = "{}.{}".format(path, index)
+        if os.path.exists(rotated):
+            yield from read_capture(rotated)
+    yield from read_capture(path)
+
+
+def replay(records, speed=0.0, write=None):
+    # feeds the RX records through a SATPDecoder, speed 1.0 keeps the recorded
+    # timing, 0 replays as fast as possible; write(data) additionally gets
+    # every RX record, e.g. to write it to a pseudo terminal; the pause
+    # between two runs (START records) is not replayed
+    decoder = SATPDecoder()
+    frames = {TX: 0, RX: 0}
+    size = 0
+
+    first = None
+    start = time.perf_counter()
+    base = start
+    for timestamp, direction, data in records:
+        if direction == START:
+            first = None
+            continue
+
+        if speed > 0:
+            if first is None:
+                first = timestamp
+                base = time.perf_counter()
+            delay = (timestamp - first) / speed - (time.perf_counter() - base)
+            if delay > 0:
+                time.sleep(delay)
+
+        if direction == TX:
+            frames[TX] += 1
+            continue
+
+        size += len(data)
+        frames[RX] += len(decoder.feed(data))
+        if write:
+            write(data)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "frames_tx": frames[TX],
+        "frames_rx": frames[RX],
+        "bytes_rx": size,
+        "errors": decoder.errors,
+        "elapsed": elapsed,
+        "mbyte_per_s": size / elapsed / 1e6 if elapsed > 0 else 0,
+    }
+
+
+if __name__ == "__main__":
+    import json
+    import pty
+    import tty
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("file", type=str)
+    parser.add_argument("--speed", type=float, required=False, help="1 = recorded timing, default: as fast as possible (1 with --pty)")
+    parser.add_argument("--pty",
+        required=False,
+        action="store_true",
+        help="writes the RX data to a pseudo terminal that can be opened like the modem port",
+    )
+    parser.add_argument("-v", "--verbose",
+        required=False,
+        action="store_true",
+        help="prints every record",
+    )
+
+    console_args = parser.parse_args()
+
+    records = read_captures(console_args.file)
+    if console_args.verbose:
+        records = list(records)
+        for timestamp, direction, data in records:
+            print("{:.6f} {} {}".format(timestamp, DIRECTION_NAMES.get(direction, direction), data.hex()))
+
+    write = None
+    speed = console_args.speed
+    if console_args.pty:
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        print("PORT: {}".format(os.ttyname(slave)))
+        input("press enter to start the replay")
+        write = lambda data: os.write(master, data)
+        if speed is None:
+            speed = 1.0
+
+    print(json.dumps(replay(records, speed or 0.0, write), indent=4))
@@ -0,0 +1,156 @@
+# /usr/bin/env
+
+# counters and latency histograms of a SATP link, filled by MiotySerialSATP
+# (satp.metrics) and exported with
+#
+# - metrics.snapshot()              dict, e.g. for json.dumps()
+# - prometheus_text(snapshot)       Prometheus text exposition format
+# - StatsdSink(host, port).send()   StatsD gauges over UDP
+#
+# the counters are updated without a lock, a snapshot taken while another
+# thread reads the port can be off by the frames of that read
+
+from bisect import bisect_left
+import socket
+
+# upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        # "+Inf" instead of float("inf"), which json.dumps() can't write
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            cumulative.append((bound, total))
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "buckets": cumulative,
+        }
+
+
+class LinkMetrics:
+    def __init__(self):
+        self.bytes_tx = 0
+        self.bytes_rx = 0
+        self.frames_tx = 0
+        self.frames_rx = 0
+
+        # counted by SATPDecoder
+        self.errors = {"sync": 0, "header": 0, "crc": 0, "size": 0}
+
+        # command round trip per command_id, NB_SEND to TX_SUCCESS and
+        # RX_SUCCESS to the RECEIVE confirmation
+        self.round_trip = {}
+        self.tx_success = Histogram()
+        self.rx_receive = Histogram()
+
+    def observe_round_trip(self, command_id, latency):
+        histogram = self.round_trip.get(command_id)
+        if histogram is None:
+            histogram = self.round_trip[command_id] = Histogram()
+        histogram.observe(latency)
+
+    def snapshot(self):
+        return {
+            "bytes_tx": self.bytes_tx,
+            "bytes_rx": self.bytes_rx,
+            "frames_tx": self.frames_tx,
+            "frames_rx": self.frames_rx,
+            "errors": dict(self.errors),
+            "round_trip": {
+                "0x{:02x}".format(command_id): histogram.snapshot()
+                for command_id, histogram in sorted(self.round_trip.items())
+            },
+            "tx_success": self.tx_success.snapshot(),
+            "rx_receive": self.rx_receive.snapshot(),
+        }
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in labels.items()) + "}"
+
+
+def _prometheus_histogram(lines, name, histogram, labels):
+    for bound, count in histogram["buckets"]:
+        bucket_labels = dict(labels, le=bound if bound == "+Inf" else repr(bound))
+        lines.append("{}_bucket{} {}".format(name, _labels(bucket_labels), count))
+    lines.append("{}_sum{} {}".format(name, _labels(labels), histogram["sum"]))
+    lines.append("{}_count{} {}".format(name, _labels(labels), histogram["count"]))
+
+
+def prometheus_text(snapshot, labels=None, prefix="satp"):
+    # labels, e.g. {"port": "/dev/ttyACM0"}, are added to every sample
+    labels = labels or {}
+    lines = []
+
+    for direction in ("tx", "rx"):
+        lines.append("# TYPE {}_{}_bytes_total counter".format(prefix, direction))
+        lines.append("{}_{}_bytes_total{} {}".format(prefix, direction, _labels(labels), snapshot["bytes_" + direction]))
+        lines.append("# TYPE {}_{}_frames_total counter".format(prefix, direction))
+        lines.append("{}_{}_frames_total{} {}".format(prefix, direction, _labels(labels), snapshot["frames_" + direction]))
+
+    lines.append("# TYPE {}_decode_errors_total counter".format(prefix))
+    for kind, count in snapshot["errors"].items():
+        lines.append("{}_decode_errors_total{} {}".format(prefix, _labels(dict(labels, kind=kind)), count))
+
+    lines.append("# TYPE {}_round_trip_seconds histogram".format(prefix))
+    for command_id, histogram in snapshot["round_trip"].items():
+        _prometheus_histogram(lines, prefix + "_round_trip_seconds", histogram, dict(labels, command=command_id))
+
+    for name in ("tx_success", "rx_receive"):
+        lines.append("# TYPE {}_{}_seconds histogram".format(prefix, name))
+        _prometheus_histogram(lines, "{}_{}_seconds".format(prefix, name), snapshot[name], labels)
+
+    return "\n".join(lines) + "\n"
+
+
+class StatsdSink:
+    # sends a snapshot as StatsD gauges (cumulative counters, latency count,
+    # mean and max in ms) in one UDP datagram
+    def __init__(self, host="127.0.0.1", port=8125, prefix="satp"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, snapshot):
+        lines = []
+
+        for name in ("bytes_tx", "bytes_rx", "frames_tx", "frames_rx"):
+            lines.append("{}.{}:{}|g".format(self.prefix, name, snapshot[name]))
+        for kind, count in snapshot["errors"].items():
+            lines.append("{}.errors.{}:{}|g".format(self.prefix, kind, count))
+
+        histograms = [("round_trip." + command_id, histogram) for command_id, histogram in snapshot["round_trip"].items()]
+        histograms += [("tx_success", snapshot["tx_success"]), ("rx_receive", snapshot["rx_receive"])]
+        for name, histogram in histograms:
+            lines.append("{}.{}.count:{}|g".format(self.prefix, name, histogram["count"]))
+            lines.append("{}.{}.mean_ms:{:.3f}|g".format(self.prefix, name, histogram["mean"] * 1000))
+            lines.append("{}.{}.max_ms:{:.3f}|g".format(self.prefix, name, histogram["max"] * 1000))
+
+        self.socket.sendto("\n".join(lines).encode(), self.address)
+
+    def close(self):
+        self.socket.close()
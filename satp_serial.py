@@ -1,8 +1,39 @@
 # /usr/bin/env
 
 import serial
+from satp_metrics import LinkMetrics
+import json
+import os
+import queue
+import struct
+import threading
 import time
+from collections import deque, namedtuple
 
+CRC_POLYNOMIAL = 0x3D65
+
+
+def _build_crc_table(polynomial):
+    table = []
+
+    for byte in range(256):
+        reg = byte << 8
+        for b_i in range(8):
+            if reg & 0x8000:
+                reg = ((reg << 1) ^ polynomial) & 0xFFFF
+            else:
+                reg = (reg << 1) & 0xFFFF
+        table.append(reg)
+
+    return tuple(table)
+
+
+_CRC_TABLE = _build_crc_table(CRC_POLYNOMIAL)
+
+# indication as passed to the subscribers of MiotySerialSATP, event is the
+# E_STACK_EVENT_* code, data the rest of the parameter and received the
+# time.monotonic() of the reception
+StackEvent = namedtuple("StackEvent", ["event", "name", "data", "received"])
 
 class MiotySerialSATP:
     # CONSTANTS
@@ -80,139 +111,687 @@ class MiotySerialSATP:
 
     SATP_STACK_MANUFACTURER = 0x01
 
-    def __init__(self, baudrate, port):
+    #   TIMING
+
+    CONFIRMATION_TIMEOUT = 2.0
+    READ_TIMEOUT = 0.05
+
+    INDICATION_QUEUE_SIZE = 256
+
+    EVENT_NAMES = {
+        E_STACK_EVENT_SLEEP: "SLEEP",
+        E_STACK_EVENT_RX_ERROR: "RX_ERROR",
+        E_STACK_EVENT_TX_SUCCESS: "TX_SUCCESS",
+        E_STACK_EVENT_RX_SUCCESS: "RX_SUCCESS",
+        E_STACK_EVENT_PERSISTENT_DATA_UPDATE: "PERSISTENT_DATA_UPDATE",
+        E_STACK_EVENT_CRYPTO_ERROR: "CRYPTO_ERROR",
+        E_STACK_EVENT_WAKEUP: "WAKEUP",
+    }
+
+    def __init__(self, baudrate, port, confirmation_timeout=CONFIRMATION_TIMEOUT, metrics=None, capture=None):
         self.serial = serial.Serial()
 
         self.serial.baudrate = baudrate
         self.serial.port = port
+        self.serial.timeout = self.READ_TIMEOUT
+        if os.name == "posix":
+            # a port that another process (session, discovery) holds fails
+            # to open instead of both reading the same frames
+            self.serial.exclusive = True
+
+        self.confirmation_timeout = confirmation_timeout
+
+        # several ports can share one LinkMetrics
+        self.metrics = metrics or LinkMetrics()
+
+        # optional satp_capture.FrameCapture, records the raw traffic
+        self.capture = capture
+
+        # the encoder buffer is shared, pack() and write of a frame must not
+        # interleave with those of another thread
+        self.encoder = SATPEncoder()
+        self._encoder_lock = threading.Lock()
+        self.decoder = SATPDecoder(self.metrics.errors)
+
+        # indications that arrive while waiting for a confirmation are passed
+        # to on_indication if it is set, otherwise they are queued here
+        self.indications = deque(maxlen=self.INDICATION_QUEUE_SIZE)
+        self.on_indication = None
+
+        # time.monotonic() of the reception of every queued indication and
+        # of the last confirmation
+        self._indication_times = deque(maxlen=self.INDICATION_QUEUE_SIZE)
+        self.confirmation_received = None
+
+        # called with every indication in addition to the above
+        self.indication_listeners = []
+
+        # (callback, events) called with a StackEvent, see subscribe()
+        self._subscribers = []
+
+        self._confirmations = deque()
+
+        # (command_id, sent) of the commands waiting for a confirmation and
+        # the times of the last NB_SEND and E_STACK_EVENT_RX_SUCCESS
+        self._pending = deque()
+        self._tx_started = None
+        self._rx_success = None
+
+        # with the reader thread running, only the reader reads the port and
+        # the other threads wait on the condition for dispatched frames
+        self._reader = None
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._seen_generation = 0
 
         self.serial.open()
 
-    def send_data(self, api_id, command_id, parameter=[]):
-        data = bytearray(
-            self._pack_data(
-                api_id,
-                command_id,
-                parameter,
-            )
-        )
+    def close(self):
+        self.stop_reader()
+        self.serial.close()
+        if self.capture:
+            self.capture.close()
 
-        self.serial.write(data)
+    def start_reader(self):
+        # reads the port on a dedicated thread, subscribers are then called
+        # as soon as an indication arrives, without polling
+        if self._reader:
+            return
 
-    def check_serial(self):
-        return self.serial.inWaiting()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def stop_reader(self):
+        reader = self._reader
+        if reader:
+            self._reader = None
+            reader.join()
+
+    def subscribe(self, callback, events=None):
+        # callback(StackEvent) for every indication, or only for the
+        # E_STACK_EVENT_* codes in events
+        self._subscribers.append((callback, events))
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers = [subscriber for subscriber in self._subscribers if subscriber[0] is not callback]
+
+    def events(self, events=None, timeout=None):
+        # iterator over the StackEvents, ends after timeout seconds without
+        # an event, does not end if timeout is None
+        # every access of received.put is a new bound method, unsubscribe()
+        # needs the same object
+        received = queue.SimpleQueue()
+        put = self.subscribe(received.put, events)
+
+        try:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                try:
+                    yield received.get_nowait()
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return
+                    self._receive()
+        finally:
+            self.unsubscribe(put)
 
-    def read_data(self):
-        received_data = []
-        messages = []
+    def send_data(self, api_id, command_id, parameter=b""):
+        with self._encoder_lock:
+            self._write(self.encoder.pack(api_id, command_id, parameter), api_id, (command_id,))
 
-        while self.serial.inWaiting() > 0:
-            data = self.serial.read(1)
+    def send_with_confirmation(self, api_id, command_id, parameter=b"", timeout=None):
+        # a confirmation that arrived after an earlier timeout is stale
+        self._confirmations.clear()
+        self._pending.clear()
 
-            if data != "":
-                received_data.append(data[0])
+        self.send_data(api_id, command_id, parameter)
 
-        # print(received_data)
+        return self.wait_for_confirmation(timeout)
 
-        read_next = True
-        shift = 0
-        if received_data:
-            while read_next:
-                message = self._unpack_data(received_data[shift:])
-                messages.append(message[1:])
+    def stack_event(self, message):
+        parameter = message[3] or b""
+        event = parameter[0] if parameter else None
 
-                # print(message)
+        return StackEvent(event, self.EVENT_NAMES.get(event), bytes(parameter[1:]), time.monotonic())
 
-                if message and message[0]:
-                    shift += message[0]
-                    if shift >= len(received_data):
-                        read_next = False
-                else:
-                    read_next = False
+    def transfer_params(self, params, timeout=None):
+        # params is a list of (param_id, value), value None reads the
+        # parameter; all GET/SET frames are written at once and the
+        # confirmations, which come back in the same order, are matched to
+        # them; returns {param_id: confirmation or None on timeout}
+        self._confirmations.clear()
+        self._pending.clear()
 
-        return messages
+        frames = []
+        for param_id, value in params:
+            if value is None:
+                frames.append(pack_frame(self.API_SATP_STACK_CMD, self.SATP_STACK_GET, bytes((param_id,))))
+            else:
+                frames.append(pack_frame(self.API_SATP_STACK_CMD, self.SATP_STACK_SET, bytes((param_id,)) + bytes(value)))
+        self._write(
+            b"".join(frames),
+            self.API_SATP_STACK_CMD,
+            [self.SATP_STACK_GET if value is None else self.SATP_STACK_SET for _, value in params],
+        )
 
-    def _calc_crc(self, data) -> tuple:
-        crc_pol = 0x3D65
+        result = {}
+        for param_id, _ in params:
+            confirmation = self.wait_for_confirmation(timeout)
+            result[param_id] = confirmation
+            if confirmation is None:
+                # the order is lost, later confirmations are not matched
+                timeout = 0
+
+        return result
+
+    def wait_for_confirmation(self, timeout=None):
+        if timeout is None:
+            timeout = self.confirmation_timeout
+
+        deadline = time.monotonic() + timeout
+
+        while not self._confirmations:
+            if time.monotonic() >= deadline:
+                return None
+            self._receive()
+
+        return self._confirmations.popleft()
+
+    def wait_for_indication(self, events, timeout, since=None):
+        # returns the first queued or newly received indication whose event is
+        # in events, other indications stay queued; matching indications
+        # received before since (a time.monotonic(), e.g. the
+        # confirmation_received of the command) are stale and dropped
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._condition:
+                index = 0
+                while index < len(self.indications):
+                    message = self.indications[index]
+                    if message[3] and message[3][0] in events:
+                        received = self._indication_times[index]
+                        del self.indications[index]
+                        del self._indication_times[index]
+                        if since is None or received >= since:
+                            return message
+                        continue
+                    index += 1
+            if time.monotonic() >= deadline:
+                return None
+            self._receive()
+
+    def poll(self):
+        # reads what arrives within READ_TIMEOUT and dispatches it, for
+        # callers that handle indications through on_indication
+        self._receive()
 
-        reg = 0
+    def check_serial(self):
+        return len(self.indications) or self.serial.in_waiting
 
-        if len(data) > 0:
-            reg = data[0] << 8
-            if len(data) > 1:
-                reg += data[1]
+    def read_data(self):
+        with self._condition:
+            messages = list(self.indications)
+            self.indications.clear()
+            self._indication_times.clear()
+
+        if self._reader:
+            return messages
+
+        waiting = self.serial.in_waiting
+        while waiting > 0:
+            data = self.serial.read(waiting)
+            self.metrics.bytes_rx += len(data)
+            if self.capture:
+                self.capture.rx(data)
+            for message in self.decoder.feed(data):
+                self._count_rx(message)
+                if message[1] == self.API_SATP_STACK_IND:
+                    self._notify(message)
+                messages.append(message)
+            waiting = self.serial.in_waiting
 
-        for next_byte in data[2:]:
-            for b_i in range(8):
-                reg_Hb = reg >> 15
-                reg = (reg << 1) & 0xFFFF
-                reg += (next_byte >> 7) & 1
-                next_byte <<= 1
-                if reg_Hb:
-                    reg ^= crc_pol
+        return messages
 
-        for b_i in range(16):
-            reg_Hb = reg >> 15
-            reg = (reg << 1) & 0xFFFF
-            if reg_Hb:
-                reg ^= crc_pol
+    def _receive(self):
+        # blocks until at least one frame is dispatched (reader thread) or one
+        # byte arrives, at most READ_TIMEOUT
+        if self._reader and threading.current_thread() is not self._reader:
+            with self._condition:
+                if self._generation == self._seen_generation:
+                    self._condition.wait(self.READ_TIMEOUT)
+                self._seen_generation = self._generation
+            return
 
-        crc_H = int(reg / 256)
-        crc_L = reg % 256
+        data = self.serial.read(max(self.serial.in_waiting, 1))
+        self.metrics.bytes_rx += len(data)
+        if self.capture and data:
+            self.capture.rx(data)
+
+        for message in self.decoder.feed(data):
+            self._count_rx(message)
+            self._dispatch(message)
+
+    def _read_loop(self):
+        while self._reader:
+            try:
+                self._receive()
+            except (serial.SerialException, OSError, TypeError):
+                # port closed
+                self._reader = None
+
+    def _dispatch(self, message):
+        received = time.monotonic()
+
+        if message[1] == self.API_SATP_STACK_IND:
+            self._notify(message)
+            if self.on_indication:
+                self.on_indication(message)
+                message = None
+
+        with self._condition:
+            if message is None:
+                pass
+            elif message[1] == self.API_SATP_STACK_IND:
+                self.indications.append(message)
+                self._indication_times.append(received)
+            else:
+                self._confirmations.append(message)
+                self.confirmation_received = received
+            self._generation += 1
+            self._condition.notify_all()
+
+    def _notify(self, message):
+        for listener in self.indication_listeners:
+            listener(message)
+
+        if self._subscribers:
+            event = self.stack_event(message)
+            for callback, events in self._subscribers:
+                if events is None or event.event in events:
+                    callback(event)
+
+    def _write(self, data, api_id, command_ids):
+        # data holds one frame per command_id
+        self.serial.write(data)
+        if self.capture:
+            self.capture.tx(data)
+
+        metrics = self.metrics
+        metrics.bytes_tx += len(data)
+        metrics.frames_tx += len(command_ids)
+
+        if api_id == self.API_SATP_STACK_CMD:
+            now = time.monotonic()
+            for command_id in command_ids:
+                self._pending.append((command_id, now))
+                if command_id == self.SATP_STACK_NB_SEND:
+                    self._tx_started = now
+
+    def _count_rx(self, message):
+        metrics = self.metrics
+        metrics.frames_rx += 1
+
+        if message[1] == self.API_SATP_STACK_IND:
+            event = message[3][0] if message[3] else None
+            if event == self.E_STACK_EVENT_TX_SUCCESS and self._tx_started is not None:
+                metrics.tx_success.observe(time.monotonic() - self._tx_started)
+                self._tx_started = None
+            elif event == self.E_STACK_EVENT_RX_SUCCESS:
+                self._rx_success = time.monotonic()
+        elif self._pending:
+            # confirmations come back in the order of the commands
+            command_id, sent = self._pending.popleft()
+            now = time.monotonic()
+            metrics.observe_round_trip(command_id, now - sent)
+            if command_id == self.SATP_STACK_RECEIVE and self._rx_success is not None:
+                metrics.rx_receive.observe(now - self._rx_success)
+                self._rx_success = None
 
-        return (~crc_H) & 0xFF, (~crc_L) & 0xFF
+    def _calc_crc(self, data) -> tuple:
+        return calc_crc(data)
 
     def _pack_data(self, api_id, comand_id, parameter):
-        length = 3 + len(parameter)
+        return pack_frame(api_id, comand_id, parameter)
+
+
+class StackParamCache:
+    # read-through / write-through cache of the stack parameters of one
+    # module, keyed by its EUI64 and optionally persisted to a JSON file
+    #
+    # E_STACK_EVENT_PERSISTENT_DATA_UPDATE invalidates the cache, unless it
+    # follows one of our own SETs within OWN_WRITE_WINDOW seconds
+    CACHED_PARAMS = (
+        MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_PROFILE,
+        MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_MODE,
+        MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_EUI64,
+        MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_SHORT_ADDR,
+        MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_TX_POWER,
+    )
 
-        l_H = int(length / 256)
-        l_L = length % 256
+    OWN_WRITE_WINDOW = 2.0
 
-        payload = [0x07, api_id, comand_id] + parameter
+    def __init__(self, satp, path=None):
+        self.satp = satp
+        self.path = path
 
-        crc_H, crc_L = self._calc_crc(payload)
+        self.eui64 = None
+        self.params = {}
 
-        return [0xA5, l_H, l_L, (~l_H) & 0xFF, (~l_L) & 0xFF] + payload + [crc_H, crc_L]
+        self._own_writes = deque()
 
-    def _unpack_data(self, data):
-        if data[0] == 165:
-            if len(data) > 6:
-                length = data[1] * 256 + data[2]
-                if length == 256 * ((~data[3]) & 0xFF) + ((~data[4]) & 0xFF):
-                    if len(data) >= 7 + length:
-                        payload = data[5 : 5 + length]
-                        message_len = 7 + length
-                    else:
-                        print("SIZE ERROR [2]")
-                        return
-                else:
-                    print("ERROR: data is corrupted")
-                    return
+        # invalidated before the EUI64 was known, the stored entry is stale
+        self._discard_stored = False
+
+        satp.indication_listeners.append(self._on_indication)
+
+    def get(self, param_id, timeout=None):
+        # returns a confirmation like MiotySerialSATP.send_with_confirmation
+        if param_id in self.CACHED_PARAMS and self._load():
+            if param_id in self.params:
+                return self._confirmation(self.params[param_id])
+
+        confirmation = self.satp.send_with_confirmation(
+            MiotySerialSATP.API_SATP_STACK_CMD,
+            MiotySerialSATP.SATP_STACK_GET,
+            bytes((param_id,)),
+            timeout,
+        )
+        if param_id in self.CACHED_PARAMS and self._succeeded(confirmation) and confirmation[3] and self.eui64:
+            self.params[param_id] = bytes(confirmation[3])
+            self._save()
+
+        return confirmation
+
+    def set(self, param_id, value, timeout=None):
+        # the update indication can arrive before the confirmation
+        self._own_writes.append(time.monotonic())
+        confirmation = self.satp.send_with_confirmation(
+            MiotySerialSATP.API_SATP_STACK_CMD,
+            MiotySerialSATP.SATP_STACK_SET,
+            bytes((param_id,)) + bytes(value),
+            timeout,
+        )
+
+        if self._succeeded(confirmation):
+            if param_id in self.CACHED_PARAMS:
+                if self._load():
+                    self.params[param_id] = bytes(value)
             else:
-                print("SIZE ERROR [1]")
-                return
+                # e.g. a new network key, derived values may change; the EUI64
+                # is needed to clear the stored entry as well
+                self._load()
+                self.invalidate()
+            self._save()
         else:
-            print("SYNC BYTE ERROR")
+            self.params.pop(param_id, None)
+
+        return confirmation
+
+    def transfer(self, params, timeout=None):
+        # like MiotySerialSATP.transfer_params(), cached values are not read
+        # from the module again
+        result = {}
+        if any(value is None and param_id in self.CACHED_PARAMS for param_id, value in params) and self._load():
+            for param_id, value in params:
+                if value is None and param_id in self.params:
+                    result[param_id] = self._confirmation(self.params[param_id])
+
+        pending = [(param_id, value) for param_id, value in params if param_id not in result]
+        if pending:
+            for param_id, value in pending:
+                if value is not None:
+                    self._own_writes.append(time.monotonic())
+
+            result.update(self.satp.transfer_params(pending, timeout))
+
+            if any(
+                value is not None and param_id not in self.CACHED_PARAMS and self._succeeded(result[param_id])
+                for param_id, value in pending
+            ):
+                self._load()
+                self.invalidate()
+
+            for param_id, value in pending:
+                confirmation = result[param_id]
+                if param_id not in self.CACHED_PARAMS:
+                    continue
+                if not self._succeeded(confirmation):
+                    self.params.pop(param_id, None)
+                elif value is not None:
+                    if self._load():
+                        self.params[param_id] = bytes(value)
+                elif confirmation[3] and self.eui64:
+                    self.params[param_id] = bytes(confirmation[3])
+
+            self._save()
+
+        return result
+
+    def invalidate(self):
+        if not self.eui64:
+            # e.g. from an indication, where the EUI64 can not be read
+            self._discard_stored = True
+
+        eui64 = self.params.get(MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_EUI64)
+        self.params = {}
+        if eui64:
+            self.params[MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_EUI64] = eui64
+        self._save()
+
+    def _load(self):
+        # the EUI64 is read once from the module, it is the key of the cache
+        if self.eui64:
+            return True
+
+        confirmation = self.satp.send_with_confirmation(
+            MiotySerialSATP.API_SATP_STACK_CMD,
+            MiotySerialSATP.SATP_STACK_GET,
+            bytes((MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_EUI64,)),
+        )
+        if not self._succeeded(confirmation) or not confirmation[3]:
+            return False
+
+        self.eui64 = bytes(confirmation[3]).hex()
+        self.params = {}
+
+        if self.path and os.path.exists(self.path) and not self._discard_stored:
+            with open(self.path, "r") as cache_file:
+                stored = json.load(cache_file).get(self.eui64, {})
+            self.params = {int(param_id, 16): bytes.fromhex(value) for param_id, value in stored.items()}
+
+        self.params[MiotySerialSATP.E_STACK_PARAM_ID_MIOTY_EUI64] = bytes(confirmation[3])
+
+        if self._discard_stored:
+            self._discard_stored = False
+            self._save()
+
+        return True
+
+    def _save(self):
+        if not self.path or not self.eui64:
             return
 
-        crc_H, crc_L = self._calc_crc(payload)
+        stored = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as cache_file:
+                stored = json.load(cache_file)
 
-        if data[length + 5] == crc_H and data[length + 6] == crc_L:
-            if len(payload) > 2:
-                stack_id = payload[0]
-                api_id = payload[1]
-                command = payload[2]
-                parameter = None
-                if len(payload) > 3:
-                    parameter = payload[3:]
+        stored[self.eui64] = {hex(param_id): value.hex() for param_id, value in self.params.items()}
 
-                return message_len, stack_id, api_id, command, parameter
-            else:
-                print("SATP SIZE ERROR")
-                return message_len, None, None, None
+        with open(self.path, "w") as cache_file:
+            json.dump(stored, cache_file, indent=4)
+
+    def _on_indication(self, message):
+        if not message[3] or message[3][0] != MiotySerialSATP.E_STACK_EVENT_PERSISTENT_DATA_UPDATE:
+            return
+
+        now = time.monotonic()
+        while self._own_writes and now - self._own_writes[0] > self.OWN_WRITE_WINDOW:
+            self._own_writes.popleft()
+
+        if self._own_writes:
+            self._own_writes.popleft()
         else:
-            print("CRC ERROR")
-            return message_len, None, None, None
+            self.invalidate()
+
+    def _confirmation(self, data):
+        return (0x07, MiotySerialSATP.API_SATP_STACK_CMD, MiotySerialSATP.E_STACK_RETURN_SUCCESS, data)
+
+    def _succeeded(self, confirmation):
+        return confirmation is not None and confirmation[2] == MiotySerialSATP.E_STACK_RETURN_SUCCESS
+
+
+class SATPEncoder:
+    # packs frames into one preallocated buffer that grows only for longer
+    # frames; pack() returns a memoryview into that buffer, which stays valid
+    # until the next call
+    SYNC_BYTE = 0xA5
+    STACK_ID = 0x07
+
+    HEADER = struct.Struct(">BHHBBB")
+    CRC = struct.Struct(">BB")
+
+    FRAME_OVERHEAD = 10
+    BUFFER_SIZE = 256
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.buffer = bytearray(size)
+
+    def pack(self, api_id, command_id, parameter=b""):
+        param_len = len(parameter)
+        length = 3 + param_len
+        frame_len = self.FRAME_OVERHEAD + param_len
+
+        if frame_len > len(self.buffer):
+            self.buffer = bytearray(frame_len)
+        buffer = self.buffer
+
+        self.HEADER.pack_into(
+            buffer,
+            0,
+            self.SYNC_BYTE,
+            length,
+            (~length) & 0xFFFF,
+            self.STACK_ID,
+            api_id,
+            command_id,
+        )
+        buffer[8 : 8 + param_len] = parameter
+
+        view = memoryview(buffer)
+        self.CRC.pack_into(buffer, frame_len - 2, *calc_crc(view[5 : frame_len - 2]))
+
+        return view[:frame_len]
+
+
+class SATPDecoder:
+    SYNC_BYTE = 0xA5
+
+    HEADER_LEN = 5
+    CRC_LEN = 2
+
+    def __init__(self, errors=None, verbose=False):
+        self.buffer = bytearray()
+
+        # counts of the dropped data by kind, see LinkMetrics.errors
+        self.errors = errors if errors is not None else {"sync": 0, "header": 0, "crc": 0, "size": 0}
+        self.verbose = verbose
+
+    def reset(self):
+        self.buffer.clear()
+
+    def feed(self, data):
+        # appends a received chunk and returns every frame completed by it
+        # as (stack_id, api_id, command, parameter); an incomplete frame is
+        # kept in the buffer until the rest of it arrives
+        buffer = self.buffer
+        buffer += data
+
+        frames = []
+        end = len(buffer)
+        pos = 0
+
+        while pos < end:
+            sync = buffer.find(self.SYNC_BYTE, pos)
+            if sync < 0:
+                self._error("sync", "SYNC BYTE ERROR")
+                pos = end
+                break
+            if sync != pos:
+                self._error("sync", "SYNC BYTE ERROR")
+                pos = sync
+
+            if end - pos < self.HEADER_LEN:
+                break
+
+            l_H = buffer[pos + 1]
+            l_L = buffer[pos + 2]
+            if buffer[pos + 3] != (~l_H) & 0xFF or buffer[pos + 4] != (~l_L) & 0xFF:
+                self._error("header", "ERROR: data is corrupted")
+                pos += 1
+                continue
+
+            length = l_H * 256 + l_L
+            frame_end = pos + self.HEADER_LEN + length + self.CRC_LEN
+            if frame_end > end:
+                break
+
+            payload = bytes(buffer[pos + self.HEADER_LEN : frame_end - self.CRC_LEN])
+            crc_H, crc_L = calc_crc(payload)
+
+            if buffer[frame_end - 2] != crc_H or buffer[frame_end - 1] != crc_L:
+                # the length may be corrupted as well, resync on the next
+                # sync byte instead of skipping the whole frame
+                self._error("crc", "CRC ERROR")
+                pos += 1
+                continue
+
+            pos = frame_end
+
+            if length > 2:
+                frames.append(
+                    (
+                        payload[0],
+                        payload[1],
+                        payload[2],
+                        payload[3:] if length > 3 else None,
+                    )
+                )
+            else:
+                self._error("size", "SATP SIZE ERROR")
+
+        del buffer[:pos]
+
+        return frames
+
+    def _error(self, kind, text):
+        self.errors[kind] += 1
+        if self.verbose:
+            print(text)
+
+
+def calc_crc(data) -> tuple:
+    # table driven form of the augmented bitwise CRC: loading the first two
+    # bytes into the register and shifting in 16 zero bits at the end is the
+    # same as running the direct algorithm over the whole message
+    table = _CRC_TABLE
+    reg = 0
+
+    for next_byte in data:
+        reg = ((reg << 8) & 0xFFFF) ^ table[(reg >> 8) ^ next_byte]
+
+    if len(data) == 1:
+        # a single byte is loaded as the high register byte only
+        reg = ((reg << 8) & 0xFFFF) ^ table[reg >> 8]
+
+    return (~reg >> 8) & 0xFF, (~reg) & 0xFF
+
+
+def pack_frame(api_id, comand_id, parameter=b""):
+    return bytes(SATPEncoder(SATPEncoder.FRAME_OVERHEAD + len(parameter)).pack(api_id, comand_id, parameter))
 
 
 def int2hex4list(int_list, without_0x=False):
@@ -0,0 +1,50 @@
+# /usr/bin/env
+
+from mioty_adaptive import AdaptiveTxController, decode_rssi_echo
+import pytest
+
+
+def rssi_echo(rssi):
+    # the downlink bytes of the RSSI echo of mioty_mqtt_script.py
+    return bytes((int(rssi) & 0xFF, abs(int(round(rssi - int(rssi), 2) * 100))))
+
+
+class StubSensor:
+    def __init__(self, tx_power=14):
+        self.tx_power = tx_power
+
+    def get_set_params(self, tx_power, mioty_mode, mioty_profile):
+        if tx_power is not None and tx_power is not True:
+            self.tx_power = tx_power - 256 if tx_power > 127 else tx_power
+        return {"tx_power": self.tx_power}
+
+
+@pytest.mark.parametrize("rssi", [-128.0, -128.5, -129.0, -130.2, -133.75, -135.0, -139.99, -140.0])
+def test_weak_rssi_echo(rssi):
+    assert decode_rssi_echo(rssi_echo(rssi)) == pytest.approx(rssi)
+
+
+@pytest.mark.parametrize("rssi", [-1.5, -60.0, -90.25, -127.0])
+def test_rssi_echo(rssi):
+    assert decode_rssi_echo(rssi_echo(rssi)) == pytest.approx(rssi)
+
+
+def test_weak_link_raises_tx_power():
+    sensor = StubSensor(tx_power=10)
+    controller = AdaptiveTxController(sensor, window=3)
+
+    for _ in range(3):
+        settings = controller.update(decode_rssi_echo(rssi_echo(-130.2)))
+
+    assert settings == {"tx_power": 14, "step": 0}
+    assert sensor.tx_power == 14
+
+
+def test_strong_link_lowers_tx_power():
+    sensor = StubSensor(tx_power=14)
+    controller = AdaptiveTxController(sensor, window=3)
+
+    for _ in range(3):
+        settings = controller.update(decode_rssi_echo(rssi_echo(-100.0)))
+
+    assert settings["tx_power"] < 14
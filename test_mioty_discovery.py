@@ -0,0 +1,42 @@
+# /usr/bin/env
+
+from satp_serial import MiotySerialSATP as SSATP
+from mioty_discovery import discover, format_eui64, probe, read_cache
+from fake_modem import FakeModem
+import json
+import os
+
+import pytest
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="exclusive open is POSIX only")
+
+
+def test_port_in_use_is_not_probed():
+    with FakeModem() as modem:
+        eui64 = format_eui64(modem.params[SSATP.E_STACK_PARAM_ID_MIOTY_EUI64].hex())
+
+        satp = SSATP(115200, modem.port, 0.3)
+        try:
+            assert probe(modem.port) is None
+        finally:
+            satp.close()
+
+        assert probe(modem.port) == eui64
+
+
+def test_discover_keeps_the_entry_of_a_port_in_use(tmp_path):
+    cache_path = str(tmp_path / "ports.json")
+
+    with FakeModem() as modem:
+        eui64 = format_eui64(modem.params[SSATP.E_STACK_PARAM_ID_MIOTY_EUI64].hex())
+        with open(cache_path, "w") as cache_file:
+            json.dump({"ports": {modem.port: eui64}}, cache_file)
+
+        satp = SSATP(115200, modem.port, 0.3)
+        try:
+            assert discover([modem.port], cache_path=cache_path) == {}
+        finally:
+            satp.close()
+
+        assert read_cache(cache_path) == {modem.port: eui64}
+        assert discover([modem.port], cache_path=cache_path) == {modem.port: eui64}
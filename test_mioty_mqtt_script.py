@@ -0,0 +1,163 @@
+# /usr/bin/env
+
+from mioty_mqtt_script import MqttBridge, load_config
+import json
+import time
+
+import pytest
+
+ENDPOINT = "70-b3-d5-67-70-00-00-02"
+TOPIC = "mioty/00-00-00-00-00-00-00-00/{}/uplink".format(ENDPOINT)
+
+
+class StubClient:
+    # stand-in for paho.mqtt.client.Client, passed to MqttBridge as factory
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = settings
+        self.callbacks = {}
+        self.published = []
+        self.subscribed = []
+        self.on_connect = None
+
+    def message_callback_add(self, topic, callback):
+        self.callbacks[topic] = callback
+
+    def publish(self, topic, payload):
+        self.published.append((topic, payload))
+
+    def subscribe(self, subscriptions):
+        self.subscribed += subscriptions
+
+    def connect(self, host, port=1883):
+        self.on_connect(self, None, None, 0, None)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class StubMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+        self.retain = False
+
+
+def uplink(cnt, *basestations):
+    return json.dumps(
+        {
+            "cnt": cnt,
+            "baseStations": [{"rssi": rssi, "snr": 10.0, "eqSnr": 12.0, "bsEui": bs_eui} for bs_eui, rssi in basestations],
+        }
+    ).encode()
+
+
+def make_config(subscriptions, brokers=None, **settings):
+    config = load_config()
+    config.update({"debug": False, "workers": 1, "coalesce_window": 0.05})
+    config.update(settings)
+    config["brokers"] = brokers or {"default": {"host": "localhost", "port": 1883, "client_id": "test"}}
+    config["subscriptions"] = subscriptions
+    return config
+
+
+def start(config):
+    clients = []
+
+    def factory(name, settings):
+        clients.append(StubClient(name, settings))
+        return clients[-1]
+
+    bridge = MqttBridge(config, factory)
+    bridge.start()
+    return bridge, clients
+
+
+def deliver(client, filter, topic, payload):
+    client.callbacks[filter](client, None, StubMessage(topic, payload))
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_best_rssi_of_separate_reports():
+    bridge, (client,) = start(make_config([{"broker": "default", "topic": "mioty/+/+/uplink"}]))
+    try:
+        deliver(client, "mioty/+/+/uplink", TOPIC, uplink(7, ("bs-1", -120.0)))
+        deliver(client, "mioty/+/+/uplink", TOPIC, uplink(7, ("bs-2", -90.25)))
+
+        assert wait_for(lambda: client.published)
+        time.sleep(0.1)
+        assert client.published == [(TOPIC.replace("/uplink", "/downlink"), b'{"data": [-90, 25], "format": 0, "presched": true}')]
+
+        # a late report of the answered telegram is a duplicate
+        deliver(client, "mioty/+/+/uplink", TOPIC, uplink(7, ("bs-3", -80.0)))
+        assert wait_for(lambda: bridge.metrics.snapshot(0)["duplicates"] == 2)
+        assert len(client.published) == 1
+    finally:
+        bridge.stop()
+
+
+def test_brokers_with_the_same_address_share_a_connection():
+    settings = {"host": "localhost", "port": 1883, "client_id": "test"}
+    bridge, clients = start(
+        make_config(
+            [{"broker": "a", "topic": "mioty/a/+/uplink"}, {"broker": "b", "topic": "mioty/b/+/uplink"}],
+            {"a": dict(settings), "b": dict(settings)},
+        )
+    )
+    bridge.stop()
+
+    assert len(clients) == 1
+    assert clients[0].subscribed == [("mioty/a/+/uplink", 0), ("mioty/b/+/uplink", 0)]
+
+
+def test_conflicting_broker_settings_are_rejected():
+    brokers = {
+        "a": {"host": "localhost", "port": 1883, "client_id": "a"},
+        "b": {"host": "localhost", "port": 1883, "client_id": "b"},
+    }
+    with pytest.raises(ValueError):
+        MqttBridge(make_config([{"broker": "a", "topic": "x/a"}, {"broker": "b", "topic": "x/b"}], brokers), StubClient)
+
+
+def test_topic_subscribed_twice_is_rejected():
+    subscriptions = [
+        {"broker": "default", "topic": "mioty/+/+/uplink", "handler": "rssi_echo"},
+        {"broker": "default", "topic": "mioty/+/+/uplink", "handler": "link_analytics"},
+    ]
+    with pytest.raises(ValueError):
+        MqttBridge(make_config(subscriptions), StubClient)
+
+
+def test_overlapping_handlers_each_get_the_uplink(tmp_path):
+    subscriptions = [
+        {"broker": "default", "topic": "mioty/+/+/uplink", "handler": "rssi_echo"},
+        {"broker": "default", "topic": "mioty/+/{}/uplink".format(ENDPOINT), "handler": "link_analytics"},
+    ]
+    bridge, (client,) = start(make_config(subscriptions, analytics={"path": str(tmp_path / "analytics.json")}))
+    try:
+        for filter in ("mioty/+/+/uplink", "mioty/+/{}/uplink".format(ENDPOINT)):
+            deliver(client, filter, TOPIC, uplink(7, ("bs-1", -120.0)))
+        deliver(client, "mioty/+/{}/uplink".format(ENDPOINT), TOPIC, uplink(8, ("bs-1", -110.0)))
+
+        # the echo is sent although link_analytics handled the telegram too
+        assert wait_for(lambda: client.published)
+        assert wait_for(lambda: bridge.metrics.snapshot(0)["handled"] == 3)
+
+        # the report of telegram 7 is recorded once, though both handlers got it
+        report = bridge.analytics.snapshot()[ENDPOINT]
+        assert report["received"] == 2
+        assert report["baseStations"]["bs-1"]["samples"] == 2
+    finally:
+        bridge.stop()
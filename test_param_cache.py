@@ -0,0 +1,83 @@
+# /usr/bin/env
+
+from satp_serial import MiotySerialSATP as SSATP
+from satp_serial import StackParamCache
+from fake_modem import FakeModem
+import json
+
+EUI64 = "70b3d56770000001"
+SHORT_ADDR = SSATP.E_STACK_PARAM_ID_MIOTY_SHORT_ADDR
+TX_POWER = SSATP.E_STACK_PARAM_ID_MIOTY_TX_POWER
+
+
+def open_cache(modem, path=None):
+    satp = SSATP(115200, modem.port, 0.5)
+    return satp, StackParamCache(satp, path)
+
+
+def test_get_is_read_once():
+    with FakeModem() as modem:
+        satp, cache = open_cache(modem)
+        try:
+            assert cache.get(TX_POWER)[3] == b"\x0e"
+            frames = modem.frames_received
+            assert cache.get(TX_POWER)[3] == b"\x0e"
+            assert modem.frames_received == frames
+        finally:
+            satp.close()
+
+
+def test_set_writes_through():
+    with FakeModem() as modem:
+        satp, cache = open_cache(modem)
+        try:
+            cache.get(TX_POWER)
+            assert cache.set(TX_POWER, b"\x05")[2] == SSATP.E_STACK_RETURN_SUCCESS
+            assert modem.params[TX_POWER] == b"\x05"
+            assert cache.get(TX_POWER)[3] == b"\x05"
+        finally:
+            satp.close()
+
+
+def test_foreign_update_invalidates():
+    with FakeModem() as modem:
+        satp, cache = open_cache(modem)
+        try:
+            cache.get(TX_POWER)
+            modem.params[TX_POWER] = b"\x03"
+            modem.indicate(SSATP.E_STACK_EVENT_PERSISTENT_DATA_UPDATE)
+            satp.wait_for_indication((SSATP.E_STACK_EVENT_PERSISTENT_DATA_UPDATE,), 1.0)
+            assert cache.get(TX_POWER)[3] == b"\x03"
+        finally:
+            satp.close()
+
+
+def test_transfer_reads_only_uncached():
+    with FakeModem() as modem:
+        satp, cache = open_cache(modem)
+        try:
+            cache.get(TX_POWER)
+            result = cache.transfer([(TX_POWER, None), (SHORT_ADDR, None)])
+            assert result[TX_POWER][3] == b"\x0e"
+            assert result[SHORT_ADDR][3] == b"\x00\x01"
+        finally:
+            satp.close()
+
+
+def test_new_network_key_clears_the_stored_entry(tmp_path):
+    path = str(tmp_path / "cache.json")
+    with open(path, "w") as cache_file:
+        json.dump({EUI64: {hex(SHORT_ADDR): "0001"}}, cache_file)
+
+    with FakeModem() as modem:
+        # the module derives a new short address from the new key
+        modem.params[SHORT_ADDR] = b"\xbe\xef"
+        satp, cache = open_cache(modem, path)
+        try:
+            cache.set(SSATP.E_STACK_PARAM_ID_MIOTY_NWKKEY, bytes(range(16)))
+            assert cache.get(SHORT_ADDR)[3] == b"\xbe\xef"
+        finally:
+            satp.close()
+
+    with open(path, "r") as cache_file:
+        assert json.load(cache_file)[EUI64][hex(SHORT_ADDR)] == "beef"
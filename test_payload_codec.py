@@ -0,0 +1,96 @@
+# /usr/bin/env
+
+from payload_codec import Schema, load_schema
+import os
+
+import pytest
+
+EXAMPLE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payload_schema.example.json")
+
+
+def roundtrip(fields, record):
+    schema = Schema(fields)
+    data = schema.encode(record)
+    assert schema.decode(data) == record
+    return data
+
+
+def test_uint_and_int():
+    fields = [{"name": "a", "type": "uint", "bits": 4}, {"name": "b", "type": "int", "bits": 5}]
+
+    assert roundtrip(fields, {"a": 15, "b": -16}) == bytes((0b11111000, 0b00000000))
+    roundtrip(fields, {"a": 0, "b": 15})
+
+
+def test_scale_and_offset():
+    roundtrip([{"name": "battery", "type": "uint", "bits": 8, "scale": 0.02, "offset": 2.0}], {"battery": 3.3})
+    roundtrip([{"name": "temperature", "type": "int", "bits": 11, "scale": 0.1}], {"temperature": -40.5})
+
+
+def test_bool_and_float():
+    data = roundtrip([{"name": "on", "type": "bool"}, {"name": "value", "type": "float"}], {"on": True, "value": 0.5})
+    assert len(data) == 5
+
+
+@pytest.mark.parametrize("value", [0, 1, -1, 63, -64, 64, 300, -300, 1 << 40])
+def test_varint(value):
+    roundtrip([{"name": "value", "type": "varint"}], {"value": value})
+
+
+def test_unsigned_varint():
+    assert roundtrip([{"name": "value", "type": "varint", "signed": False}], {"value": 300}) == bytes((0xAC, 0x02))
+
+
+def test_series():
+    roundtrip([{"name": "values", "type": "series", "bits": 6}], {"values": [1, 2, 3]})
+    roundtrip([{"name": "values", "type": "series", "bits": 6, "count": 2}], {"values": [-5, 7]})
+    roundtrip([{"name": "values", "type": "series"}], {"values": []})
+
+
+def test_series_with_delta():
+    fields = [{"name": "values", "type": "series", "bits": 11, "scale": 0.1, "delta": True}]
+
+    data = roundtrip(fields, {"values": [21.5, 21.6, 21.4, 20.0]})
+    # length, 11 bits for the first value and one byte per small difference
+    assert len(data) == 6
+    roundtrip([{"name": "values", "type": "series", "delta": True}], {"values": [-1000, 1000, 0]})
+
+
+def test_out_of_range():
+    with pytest.raises(ValueError):
+        Schema([{"name": "a", "type": "uint", "bits": 4}]).encode({"a": 16})
+    with pytest.raises(ValueError):
+        Schema([{"name": "a", "type": "int", "bits": 4}]).encode({"a": -9})
+    with pytest.raises(ValueError):
+        Schema([{"name": "a", "type": "series", "bits": 4, "count": 2}]).encode({"a": [1]})
+
+
+def test_negative_unsigned_varint():
+    with pytest.raises(ValueError):
+        Schema([{"name": "a", "type": "varint", "signed": False}]).encode({"a": -1})
+
+
+def test_payload_too_short():
+    with pytest.raises(ValueError):
+        Schema([{"name": "a", "type": "uint", "bits": 12}]).decode(b"\x01")
+
+
+def test_invalid_schema():
+    with pytest.raises(ValueError):
+        Schema([{"name": "a", "type": "double"}])
+    with pytest.raises(ValueError):
+        Schema([{"name": "a", "type": "int"}])
+
+
+def test_example_schema():
+    schema = load_schema(EXAMPLE_SCHEMA)
+    record = {
+        "battery": 3.0,
+        "temperature": 21.5,
+        "humidity": 45,
+        "door_open": False,
+        "counter": 1234,
+        "temperature_history": [21.5, 21.3, 21.0, 20.8],
+    }
+
+    assert schema.decode(schema.encode(record)) == record
@@ -0,0 +1,154 @@
+# /usr/bin/env
+
+from satp_serial import MiotySerialSATP as SSATP
+from satp_serial import SATPDecoder, calc_crc, pack_frame
+from fake_modem import FakeModem
+import random
+
+
+def bitwise_crc(data):
+    # the original bitwise implementation, reference for the table driven one
+    crc_pol = 0x3D65
+
+    reg = 0
+
+    if len(data) > 0:
+        reg = data[0] << 8
+        if len(data) > 1:
+            reg += data[1]
+
+    for next_byte in data[2:]:
+        for b_i in range(8):
+            reg_Hb = reg >> 15
+            reg = (reg << 1) & 0xFFFF
+            reg += (next_byte >> 7) & 1
+            next_byte <<= 1
+            if reg_Hb:
+                reg ^= crc_pol
+
+    for b_i in range(16):
+        reg_Hb = reg >> 15
+        reg = (reg << 1) & 0xFFFF
+        if reg_Hb:
+            reg ^= crc_pol
+
+    crc_H = int(reg / 256)
+    crc_L = reg % 256
+
+    return (~crc_H) & 0xFF, (~crc_L) & 0xFF
+
+
+def test_crc_matches_bitwise():
+    generator = random.Random(0x3D65)
+
+    for length in range(301):
+        for _ in range(4):
+            data = bytes(generator.getrandbits(8) for _ in range(length))
+            assert calc_crc(data) == bitwise_crc(data), data.hex()
+
+
+def test_crc_edge_values():
+    for data in (b"", b"\x00", b"\xff", b"\x00\x00", b"\xff\xff", bytes(300), b"\xff" * 300):
+        assert calc_crc(data) == bitwise_crc(data), data.hex()
+
+
+def test_crc_of_memoryview():
+    data = bytes(range(256))
+    assert calc_crc(memoryview(data)[5:200]) == bitwise_crc(data[5:200])
+
+
+def test_packed_frame_decodes():
+    frame = pack_frame(0x00, 0x03, b"\x62")
+    assert SATPDecoder().feed(frame) == [(0x07, 0x00, 0x03, b"\x62")]
+
+
+def test_frame_split_across_feeds():
+    frames = pack_frame(0x00, 0x03, b"\x62") + pack_frame(0x01, 0x02, b"\x03\x04")
+
+    for split in range(1, len(frames)):
+        decoder = SATPDecoder()
+        decoded = decoder.feed(frames[:split]) + decoder.feed(frames[split:])
+        assert decoded == [(0x07, 0x00, 0x03, b"\x62"), (0x07, 0x01, 0x02, b"\x03\x04")], split
+        assert not decoder.buffer
+
+    decoder = SATPDecoder()
+    decoded = []
+    for byte in frames:
+        decoded += decoder.feed(bytes((byte,)))
+    assert len(decoded) == 2
+
+
+def test_resync_after_garbage():
+    frame = pack_frame(0x00, 0x03, b"\x62")
+    decoder = SATPDecoder()
+
+    assert decoder.feed(b"\x00\x13\x37" + frame + b"\xff\xfe" + frame) == [(0x07, 0x00, 0x03, b"\x62")] * 2
+    assert decoder.errors["sync"] == 2
+
+
+def test_crc_corruption():
+    frame = bytearray(pack_frame(0x00, 0x03, b"\x62"))
+    frame[-1] ^= 0xFF
+    decoder = SATPDecoder()
+
+    assert decoder.feed(bytes(frame) + pack_frame(0x00, 0x00)) == [(0x07, 0x00, 0x00, None)]
+    assert decoder.errors["crc"] == 1
+
+
+def test_header_corruption():
+    frame = bytearray(pack_frame(0x00, 0x03, b"\x62"))
+    frame[3] ^= 0x01
+    decoder = SATPDecoder()
+
+    assert decoder.feed(bytes(frame) + pack_frame(0x00, 0x00)) == [(0x07, 0x00, 0x00, None)]
+    assert decoder.errors["header"] == 1
+
+
+def test_confirmations_with_corrupted_frames():
+    # every third frame of the modem has a broken CRC and trailing garbage
+    with FakeModem(corrupt_every=3) as modem:
+        satp = SSATP(115200, modem.port, 0.3)
+        try:
+            answered = 0
+            for _ in range(30):
+                confirmation = satp.send_with_confirmation(
+                    SSATP.API_SATP_STACK_CMD, SSATP.SATP_STACK_GET, bytes((SSATP.E_STACK_PARAM_ID_MIOTY_EUI64,))
+                )
+                if confirmation is not None:
+                    assert confirmation[3] == modem.params[SSATP.E_STACK_PARAM_ID_MIOTY_EUI64]
+                    answered += 1
+        finally:
+            satp.close()
+
+    assert answered == 20
+    assert satp.metrics.errors["crc"] == 10
+
+
+def test_events_unsubscribes_when_done():
+    with FakeModem() as modem:
+        satp = SSATP(115200, modem.port, 0.3)
+        try:
+            for _ in range(3):
+                modem.indicate(SSATP.E_STACK_EVENT_WAKEUP)
+                events = list(satp.events(timeout=0.2))
+                assert [event.name for event in events] == ["WAKEUP"]
+            assert not satp._subscribers
+        finally:
+            satp.close()
+
+
+if __name__ == "__main__":
+    for test in (
+        test_crc_matches_bitwise,
+        test_crc_edge_values,
+        test_crc_of_memoryview,
+        test_packed_frame_decodes,
+        test_frame_split_across_feeds,
+        test_resync_after_garbage,
+        test_crc_corruption,
+        test_header_corruption,
+        test_confirmations_with_corrupted_frames,
+        test_events_unsubscribes_when_done,
+    ):
+        test()
+    print("OK")